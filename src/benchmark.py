@@ -0,0 +1,277 @@
+"""
+This module is a benchmark suite for the scanner. It consists of the following parts:
+
+e2e:        end-to-end scanning (and analysis) of a text, as done by scan.py. The result is checked
+            against a reference output of scan.py, so that an optimization that changes any
+            scansion, method or flag is reported as a failure (and the exit status is 1)
+micro:      micro-benchmarks of the functions scanning spends most of its time in
+scaling:    end-to-end scanning with 1 to N worker processes
+throughput: the throughput (in lines per second) of building an MqDq dictionary and of scanning a
+            text. The dictionary is built from the verified scansions in the reference output,
+            which are first converted to the markup used by MqDq, so that this part does not
+            require the MqDq texts to be downloaded. The resulting dictionary is then used to scan
+            the text.
+
+By default, the Agamemnon is scanned in trimeter with the bundled manual scansions and the result
+is compared against data/fullScansions/Agamemnon.json. The reference was created with the MqDq
+dictionary, so the same dictionary should be passed with -dictionary for the check to pass. The
+results can be written to a JSON file with -output.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+
+from src.mqdq.dictionary import MqDqDictionary
+from src.normalize import NOT_LETTER, collapse_spaces, to_mqdq
+from src.scan.analyze import analyse
+from src.scan.meter import Meter
+from src.scan.scanner import Scanner
+from src.scan.verse import Verse
+from src.scan.word import Word
+from src.utils import positive_int
+
+SCANSIONS_FILE = "data/fullScansions/Agamemnon.json"
+TEXT_FILE = "data/texts/Agamemnon.txt"
+MANUAL_FILE = "data/manualScansions/Agamemnon.txt"
+PARTS = ("e2e", "micro", "scaling", "throughput")
+ORACLE_FIELDS = ("scansion", "method", "flags")  # fields that must match the reference output
+
+
+def best_time(function, repeat):
+    """
+    Measure how long a function takes to run (the best of several runs)
+    :param function:    a function without arguments
+    :param repeat:      the number of runs
+    :return:            seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def throughput(function, lines, repeat):
+    """
+    Measure how many lines per second a function processes (the best of several runs)
+    :param function:    a function that takes a list of lines
+    :param lines:       the list of lines
+    :param repeat:      the number of runs
+    :return:            lines per second
+    """
+    return len(lines) / best_time(lambda: function(lines), repeat)
+
+
+def build_dictionary(lines):
+    """
+    Build an MqDq dictionary from lines in the MqDq markup
+    :param lines:
+    :return:    MqDqDictionary
+    """
+    dictionary = MqDqDictionary()
+    for line in lines:
+        dictionary.add_verse(line, "Seneca", True)
+    return dictionary
+
+
+def scan(scanner, verses, meter):
+    """
+    Scan verses with empty word caches
+    :param scanner: Scanner
+    :param verses:  a list of strings
+    :param meter:   Meter
+    :return:        None
+    """
+    scanner.clear_caches()
+    for verse in verses:
+        Verse(verse, scanner).scan(meter, interactive=False)
+
+
+def quietly(function, *args):
+    """
+    Call a function without printing its messages and progress bars
+    :return:    the value returned by the function
+    """
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return function(*args)
+
+
+def scan_text(scanner, verses, meter, jobs):
+    """
+    Scan verses (non-interactively) in the same way as scan.py does and analyse the result
+    :param scanner:     Scanner
+    :param verses:      a list of strings
+    :param meter:       the name of the meter
+    :param jobs:        the number of worker processes to use
+    :return:            a tuple (records, stats), where records is a dictionary that maps the keys
+                        of the verses to their records
+    """
+    scanner.manual.clear()  # the manual scansions are modified during scanning
+    quietly(scanner.read_manual_file, scanner.manual_file)
+    scanner.clear_caches()
+    tasks = [(str(i), verse, meter) for i, verse in enumerate(verses)]
+    records = dict(scanner.scan_many(tasks, jobs))
+    return records, quietly(analyse, records.values())
+
+
+def compare(records, reference):
+    """
+    Compare the records of scanned verses against a reference output of scan.py
+    :param records:     a dictionary that maps the keys of the verses to their records
+    :param reference:   the same for the reference
+    :return:            the list of the keys of the verses that differ in any of ORACLE_FIELDS
+    """
+    keys = sorted(set(records) | set(reference), key=lambda x: (len(x), x))
+    return [key for key in keys if key not in records or key not in reference or
+            any(records[key][field] != reference[key][field] for field in ORACLE_FIELDS)]
+
+
+def end_to_end(scanner, verses, meter, reference, repeat):
+    """
+    Benchmark end-to-end scanning and check the result against the reference
+    :return:    a dictionary with the results
+    """
+    outputs = []
+    seconds = best_time(lambda: outputs.append(scan_text(scanner, verses, meter, 1)), repeat)
+    mismatches = compare(outputs[0][0], reference)
+    return {"verses": len(verses), "seconds": seconds, "lines_per_second": len(verses) / seconds,
+            "mismatches": len(mismatches), "mismatched_verses": mismatches[:20],
+            "passed": len(mismatches) == 0}
+
+
+def micro_benchmarks(scanner, verses, meter, lines, records, repeat):
+    """
+    Benchmark the functions scanning spends most of its time in
+    :param scanner: Scanner
+    :param verses:  a list of strings
+    :param meter:   the name of the meter
+    :param lines:   lines in the MqDq markup (see build_dictionary())
+    :param records: records of scanned verses (see analyse())
+    :param repeat:  the number of runs to take the best of
+    :return:        a dictionary that maps the name of a function to its results
+    """
+    meter = Meter.METERS[meter]
+    words = [collapse_spaces(NOT_LETTER.sub(" ", x.lower())).split(" ") for x in verses]
+    verse_objects = [Verse(x, scanner) for x in verses]
+    macronizations = [m for x in verse_objects for m in x.macronize(meter)]
+    pairs = [(m, p) for m in macronizations for p in meter.get_matching_scansions(m)]
+
+    def init_words():
+        scanner.clear_caches()  # so that every word is analysed rather than copied from the cache
+        for forms in words:
+            next_word = None
+            for form in reversed(forms):  # in the same order as in Verse.__init__()
+                next_word = Word(form, next_word, scanner)
+
+    def macronize():
+        for verse in verse_objects:
+            for _ in verse.macronize(meter):
+                pass
+
+    benchmarks = {
+        "Verse.macronize": (macronize, len(verse_objects)),
+        "Meter.get_matching_scansions": (
+            lambda: [meter.get_matching_scansions(x) for x in macronizations],
+            len(macronizations)),
+        "Scansion.apply_mask": (lambda: [x.apply_mask(y) for x, y in pairs], len(pairs)),
+        "Word.__init__": (init_words, sum(len(x) for x in words)),
+        "MqDqDictionary.add_verse": (lambda: build_dictionary(lines), len(lines)),
+        "analyse": (lambda: quietly(analyse, records), len(records)),
+    }
+    results = {}
+    for name, (function, calls) in benchmarks.items():
+        seconds = best_time(function, repeat)
+        results[name] = {"calls": calls, "seconds": seconds, "calls_per_second": calls / seconds}
+    return results
+
+
+def scaling(scanner, verses, meter, jobs, repeat):
+    """
+    Benchmark end-to-end scanning with 1 to jobs worker processes. The time includes starting the
+    workers and loading the dictionaries in them
+    :return:    a list of dictionaries with the results (one per number of workers)
+    """
+    results = []
+    for n in range(1, jobs + 1):
+        outputs = []
+        seconds = best_time(lambda: outputs.append(scan_text(scanner, verses, meter, n)), repeat)
+        if n == 1:
+            serial, serial_seconds = outputs[0][0], seconds
+        results.append({"jobs": n, "seconds": seconds, "lines_per_second": len(verses) / seconds,
+                        "speedup": serial_seconds / seconds,
+                        "matches_serial": outputs[0][0] == serial})
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark the scanner and check its output")
+    p.add_argument("-parts", type=str, nargs="+", default=list(PARTS), choices=PARTS,
+                   help="parts of the benchmark suite to run")
+    p.add_argument("-text", type=str, default=TEXT_FILE, help="the text to scan")
+    p.add_argument("-meter", type=str, default="trimeter", help="meter to scan the text with",
+                   choices=[x for x in Meter.METERS if not isinstance(Meter.METERS[x], tuple)])
+    p.add_argument("-manual_file", type=str, default=MANUAL_FILE,
+                   help="file to read manual scansions from (it is not modified)")
+    p.add_argument("-dictionary", type=str, default=None,
+                   help="MQDQ dictionary file to use during scansion (see scan.py)")
+    p.add_argument("-scansions", "-reference", dest="scansions", type=str, default=SCANSIONS_FILE,
+                   help="output of scan.py to check the result against and to build the "
+                        "dictionary for the throughput part from")
+    p.add_argument("-jobs", type=positive_int, default=os.cpu_count(),
+                   help="maximum number of worker processes in the scaling part")
+    p.add_argument("-repeat", type=int, default=3, help="number of runs to take the best of")
+    p.add_argument("-output", type=str, default=None, help="JSON file to write the results to")
+    args = p.parse_args(sys.argv[1:])
+    warnings.filterwarnings("ignore")
+
+    with open(args.scansions, "r") as file:
+        reference = json.load(file)["text"]
+    records = list(reference.values())
+    lines = [to_mqdq(x["scansion"]) for x in records if x["scansion"]]
+    with open(args.text, "r") as file:
+        verses = [line.rstrip("\n") for line in file]
+    # a Scanner with the settings scan.py uses by default:
+    scanner = Scanner(args.dictionary, args.manual_file).load()
+
+    results = {"createdOn": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "cpus": os.cpu_count(),
+               "text": args.text, "meter": args.meter, "settings": scanner.settings}
+    if "e2e" in args.parts:
+        results["e2e"] = end_to_end(scanner, verses, args.meter, reference, args.repeat)
+        print("end-to-end scanning:\t{:.0f} lines/s, {} mismatches with {}".format(
+            results["e2e"]["lines_per_second"], results["e2e"]["mismatches"], args.scansions))
+    if "micro" in args.parts:
+        results["micro"] = micro_benchmarks(scanner, verses, args.meter, lines, records,
+                                            args.repeat)
+        for name, result in results["micro"].items():
+            print("{}:\t{:.0f} calls/s".format(name, result["calls_per_second"]))
+    if "scaling" in args.parts:
+        results["scaling"] = scaling(scanner, verses, args.meter, args.jobs, args.repeat)
+        for result in results["scaling"]:
+            print("{jobs} workers:\t{lines_per_second:.0f} lines/s ({speedup:.2f}x)".format(
+                **result))
+    if "throughput" in args.parts:
+        meter = Meter.METERS[records[0]["meter"]]
+        scanner.mqdq_dict = build_dictionary(lines)
+        results["throughput"] = {
+            "dictionary_building": throughput(build_dictionary, lines, args.repeat),
+            "scanning": throughput(lambda x: scan(scanner, x, meter),
+                                   [x["verse"] for x in records], args.repeat)}
+        print("dictionary building:\t{:.0f} lines/s".format(
+            results["throughput"]["dictionary_building"]))
+        print("scanning:\t{:.0f} lines/s".format(results["throughput"]["scanning"]))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if not results.get("e2e", {"passed": True})["passed"]:
+        sys.exit(1)
@@ -4,12 +4,15 @@ This module provides tools for extracting information about natural vowel quanti
 scanned mqdq texts.
 """
 
+from multiprocessing import Pool
 from pathlib import Path
 import argparse
+import os
 import sys
 from collections import defaultdict
-from tqdm import tqdm
 import json
+from src.mqdq.manifest import Manifest
+from src.normalize import Replacer, collapse_spaces, dictionary_key, remove_diphthongs
 from src.utils import *
 
 
@@ -27,6 +30,8 @@ class MqDqDictionary:
                     "ȳ́": "y_", "ý": "y*", "ȳ": "y_", "y̆": "y^",
                     "œ": "[oe]", "œ̄́": "[oe]", "œ́": "[oe]", "œ̄": "[oe]", "œ̆": "[oe]",
                     "æ": "[ae]", "ǣ́": "[ae]", "ǽ": "[ae]", "ǣ": "[ae]", "æ̆": "[ae]"}
+    REPLACE = Replacer(REPLACEMENTS)
+    MARKUP = str.maketrans("", "", "^_*[]\n\t")  # to remove quantity symbols from the input
 
     # to catch unexpected characters
     UNEXPECTED = re.compile("[^a-z\^_‿⁔*\[\]<>\n†(\-\") –\"\t&.?!;:0-9,’“‘\"\\xc2\\xa0\\\]")
@@ -40,6 +45,8 @@ class MqDqDictionary:
     PREFIX = re.compile("^[" + DOUBLE_CONSONANTS + CONSONANTS + "]*")
     ERROR = re.compile("(?<!\[)[oyea](?![*_^\]])")  # no quantity specified
     U_ERROR = re.compile("[*_\^]u([" + VOWELS + "]|$)")  # does not work wel with novum
+    CONSONANT_U = re.compile("u([^\]\^*_])")  # u not followed by a quantity symbol
+    CONSONANT_I = re.compile("i([^\]\^*_])")  # i not followed by a quantity symbol
 
     def __init__(self):
         self.data = defaultdict(dict)
@@ -66,9 +73,16 @@ class MqDqDictionary:
         :param form:
         :return:
         """
-        key = re.sub("[^a-z]", "", form.lower())
-        key = multireplace(key, {"v": "u", "j": "i"})
-        return self.data.get(key, {})
+        return self.data.get(MqDqDictionary.get_key(form), {})
+
+    @staticmethod
+    def get_key(form):
+        """
+        Return the key under which a form is stored in the dictionary
+        :param form:
+        :return:
+        """
+        return dictionary_key(form)
 
     def add_word(self, word, next_word, author, diphthongs):
         """
@@ -94,13 +108,12 @@ class MqDqDictionary:
         if len(word) > 4 and word[-4:] in ["que^", "que*", "qve^", "qve*"]:
             self.add_word(word[:-4], "qv", author, diphthongs)
             return
-        word = re.sub("u([^\]\^*_])", r"v\1", word)
-        word = re.sub("i([^\]\^*_])", r"j\1", word)
+        word = MqDqDictionary.CONSONANT_U.sub(r"v\1", word)
+        word = MqDqDictionary.CONSONANT_I.sub(r"j\1", word)
         if not diphthongs:
-            word = re.sub("(\[ae\]|\[oe\])", "e_", word)
+            word = remove_diphthongs(word)
 
-        key = re.sub("[^a-z]", "", word.lower())
-        key = multireplace(key, {"v": "u", "j": "i"})
+        key = dictionary_key(word)
         if word not in self.data[key]:
             self.data[key][word] = defaultdict(int)
         self.data[key][word][author] += 1
@@ -113,13 +126,13 @@ class MqDqDictionary:
         :param diphthongs: if True, replace [ae] and [oe] with e
         :return:
         """
-        verse = re.sub("[\^_*\[\]\n\t]", "", verse)
-        verse = multireplace(verse.lower(), MqDqDictionary.REPLACEMENTS)
+        verse = verse.translate(MqDqDictionary.MARKUP)
+        verse = MqDqDictionary.REPLACE(verse.lower())
         if list(MqDqDictionary.UNEXPECTED.finditer(verse)):
             # warnings.warn("An unexpected character found: " + verse)
             return
         verse = MqDqDictionary.UNUSED.sub("", verse)
-        verse = re.sub(" +", " ", verse).rstrip(" ").lstrip(" ")  # removing extra spaces
+        verse = collapse_spaces(verse)  # removing extra spaces
         if len(verse) == 0:
             return
         words = verse.split(" ")
@@ -127,13 +140,19 @@ class MqDqDictionary:
         for i, word in enumerate(words[:-1]):
             self.add_word(word, words[i+1], author, diphthongs)
 
-    def augment(self, dir, authors, diphthongs):
+    def augment(self, dir, authors, diphthongs, jobs=1, manifest=None):
         """
         Augment the dictionary with scansions of all the texts written by the specified set of
         authors
         :param dir:     the directory with the scansions (where scraping.py downloads them to)
         :param authors: list of authors. If authors == [], all authors will be considered
         :param diphthongs: if True, replace [ae] and [oe] with e
+        :param jobs:    number of processes to use. Each file is then counted separately and the
+                        counts are merged in the order of files, so that the result is identical
+                        to that of a single process
+        :param manifest: a Manifest of the files the dictionary was built from (or None). If
+                        given, only new and changed files are counted, the counts of changed and
+                        deleted files are subtracted, and the manifest is updated accordingly
         :return:        None
         """
         authors_list = [str(x).split("/")[-1] for x in list(Path(dir).glob("*"))]
@@ -141,13 +160,118 @@ class MqDqDictionary:
         assert sum([x in authors_list for x in authors]) == len(authors)
         if not authors:
             authors = authors_list
-        for author in tqdm(authors):  # for any author
+            if manifest is not None:  # include the authors whose texts were all deleted
+                authors = authors + sorted({entry["author"] for entry in manifest.files.values()}
+                                           - set(authors_list))
+        tasks = []
+        for author in authors:  # for any author
             files = list(Path(dir.rstrip("/")+"/"+author).rglob("*.scanned"))
             for file in files:  # for any text of that author that can be scanned
-                with open(file, "r", encoding="utf-8") as f:
-                    verses = f.readlines()
-                for verse in verses:  # for any line in that text
-                    self.add_verse(verse, author, diphthongs)  # add the word scansions to the dictionary
+                tasks.append((str(file), author, diphthongs))
+        if manifest is not None:
+            tasks = self.__update_manifest(dir, authors, tasks, manifest)
+        elif jobs == 1:
+            for filename, author, diphthongs in progress(tasks):
+                self.add_file(filename, author, diphthongs)
+            return
+        if jobs == 1:
+            self.__merge_counts(dir, tasks, map(_count_file, tasks), manifest)
+            return
+        with Pool(jobs) as pool:
+            self.__merge_counts(dir, tasks, pool.imap(_count_file, tasks), manifest)
+
+    def __update_manifest(self, dir, authors, tasks, manifest):
+        """
+        Subtract the counts of the changed and deleted files from the dictionary and remove them
+        from the manifest
+        :param dir:         see augment()
+        :param authors:     the authors whose files are considered
+        :param tasks:       a list of tuples (filename, author, diphthongs) for all current files
+        :param manifest:    see augment()
+        :return:            the list of tasks for the files that have to be counted
+        """
+        new_tasks = []
+        for task in tasks:
+            path = os.path.relpath(task[0], dir)
+            if not manifest.is_current(path, task[0], task[1]):
+                new_tasks.append(task)
+        current = {os.path.relpath(task[0], dir) for task in tasks}
+        outdated = {os.path.relpath(task[0], dir) for task in new_tasks}
+        for path in manifest.paths(authors):
+            if path in outdated or path not in current:
+                self.subtract(manifest.remove(path))
+        return new_tasks
+
+    def __merge_counts(self, dir, tasks, counts, manifest):
+        """
+        Merge the counts of individual files into the dictionary (and record them in the manifest)
+        :param dir:         see augment()
+        :param tasks:       a list of tuples (filename, author, diphthongs)
+        :param counts:      an iterable of the data obtained from each task with _count_file()
+        :param manifest:    see augment()
+        :return:            None
+        """
+        for (filename, author, _), data in progress(zip(tasks, counts), total=len(tasks)):
+            self.merge(data)
+            if manifest is not None:
+                manifest.record(os.path.relpath(filename, dir), filename, author, data)
+
+    def add_file(self, filename, author, diphthongs):
+        """
+        Record all the word scansions in a file with scanned verses in the dictionary
+        :param filename:    the file to record the scansions from
+        :param author:      the author of the text
+        :param diphthongs:  if True, replace [ae] and [oe] with e
+        :return:            None
+        """
+        with open(filename, "r", encoding="utf-8") as f:
+            verses = f.readlines()
+        for verse in verses:  # for any line in that text
+            self.add_verse(verse, author, diphthongs)  # add the word scansions to the dictionary
+
+    def merge(self, data):
+        """
+        Add the counts from another dictionary's data to this dictionary
+        :param data:    the data attribute of another MqDqDictionary
+        :return:        None
+        """
+        for key, entry in data.items():
+            variants = self.data.setdefault(key, {})
+            for word, counts in entry.items():
+                if word not in variants:
+                    variants[word] = defaultdict(int)
+                for author, count in counts.items():
+                    variants[word][author] = variants[word].get(author, 0) + count
+
+    def subtract(self, data):
+        """
+        Subtract the counts from another dictionary's data (that were previously merged into this
+        dictionary). Entries whose counts drop to zero are removed
+        :param data:    the data attribute of another MqDqDictionary
+        :return:        None
+        """
+        for key, entry in data.items():
+            variants = self.data[key]
+            for word, counts in entry.items():
+                for author, count in counts.items():
+                    variants[word][author] -= count
+                    if variants[word][author] == 0:
+                        del variants[word][author]
+                if not variants[word]:
+                    del variants[word]
+            if not variants:
+                del self.data[key]
+
+
+def _count_file(task):
+    """
+    Count the word scansions in a single file (executed by worker processes in augment())
+    :param task:    a tuple of arguments to MqDqDictionary.add_file()
+    :return:        the data of the dictionary with the counts
+    """
+    dictionary = MqDqDictionary()
+    dictionary.add_file(*task)
+    return dictionary.data
 
 
 if __name__ == "__main__":
@@ -155,16 +279,31 @@ if __name__ == "__main__":
                                             "vowel quantities based on scansions of texts by "
                                             "a set of specific authors")
     p.add_argument("dir", type=str, help="directory from which to extract the scansions")
-    p.add_argument("output", type=argparse.FileType("w"),
-                   help="output file name and path")
+    p.add_argument("output", type=str, help="output file name and path")
     p.add_argument("-authors", type=str, nargs="*", default=[],
                    help="set of authors to consider when constructing the dictionary. Leave "
                         "blank to include all authors")
+    p.add_argument("-jobs", type=positive_int, default=1,
+                   help="number of processes to build the dictionary with")
     p.add_argument("--no_diphthongs", dest="diphthongs", action="store_false",
                    help="use to build a dictionary where 'ae' and 'oe' is replaced with 'e'")
-    p.set_defaults(diphthongs=True)
+    p.add_argument("--incremental", dest="incremental", action="store_true",
+                   help="keep a manifest of the processed files next to the output (output + "
+                        "'.manifest') and, if the output already exists, update it by only "
+                        "processing new, changed and deleted files")
+    p.set_defaults(diphthongs=True, incremental=False)
     args = p.parse_args(sys.argv[1:])
 
     dictionary = MqDqDictionary()
-    dictionary.augment(args.dir, args.authors, args.diphthongs)
-    dictionary.save(args.output)
+    manifest = None
+    if args.incremental:
+        manifest_file = args.output + Manifest.EXTENSION
+        manifest = Manifest.load(manifest_file, args.output, args.diphthongs)
+        if manifest.files:
+            with open(args.output, "r") as file:
+                dictionary.load(file)
+    dictionary.augment(args.dir, args.authors, args.diphthongs, args.jobs, manifest)
+    with open(args.output, "w") as file:
+        dictionary.save(file)
+    if args.incremental:
+        manifest.save(manifest_file, args.output)
@@ -0,0 +1,186 @@
+"""
+This module runs a local stand-in for the MqDq server, so that scraping.py can be tested without
+touching the real database. The server serves fixture pages with the same structure as MqDq (the
+list of authors, the lists of works and the pages of every work) with verses and scansions taken
+from an output file of scan.py. As on MqDq, the scansion of a page only appears after the scansion
+button is clicked, with a configurable delay. Pages are served with an ETag, so that cached copies
+can be revalidated. The server also reports how many pages were requested, how many of them were
+not modified, and the largest number of requests it served at the same time (at /stats)
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.normalize import to_mqdq
+
+SCANSIONS_FILE = "data/fullScansions/Agamemnon.json"
+# the paths of the pages that list authors and works (as in scraping.py):
+CHRONO_LIST = "/public/indici/autori/tipo/crono"
+WORK_LIST = "/public/indici/autori/idautori/"
+
+AUTHORS_PAGE = """<html><body><table>{}</table></body></html>"""
+AUTHOR_ROW = """<tr id="autori{id}" onclick="location.href='{id}'"><td><b>{name}</b></td></tr>"""
+WORKS_PAGE = """<html><body>{}</body></html>"""
+WORK_LINK = """<a class="opera" href="{href}">{title}</a>"""
+PAGE = """<html><head><script>
+function eseguiScansione(id, livello) {{
+    setTimeout(function() {{
+        var table = document.createElement("table");
+        table.className = "versoScandito";
+        table.innerHTML = {scansions};
+        document.body.appendChild(table);
+    }}, {delay});
+}}
+</script></head><body>
+<select class="form-control">{options}</select>
+<input type="hidden" name="idScansione" value="{id}">
+<input type="hidden" name="livello" value="1">
+<button class="btn btn-primary" title="" onclick="eseguiScansione({id},1)">Scansione</button>
+{verses}
+</body></html>"""
+
+
+class FixtureSite:
+    """ The fixture pages served by the stand-in server """
+
+    def __init__(self, database, records, authors, works, pages, verses, delay):
+        """
+        :param database:    the name of the database in the urls (e.g. mqdq)
+        :param records:     the records of scanned verses from an output file of scan.py
+        :param authors:     number of authors
+        :param works:       number of works per author
+        :param pages:       number of pages per work
+        :param verses:      number of verses per page
+        :param delay:       number of milliseconds after which the scansion appears on a page
+        """
+        self.database = database
+        self.records = [x for x in records if x["scansion"]]
+        self.authors = {"Auctor " + chr(ord("A") + i): i + 1 for i in range(authors)}
+        self.works = works
+        self.pages = pages
+        self.verses = verses
+        self.delay = delay
+
+    def get(self, path):
+        """
+        Return the page at the given path
+        :param path:    the path part of the url
+        :return:        a string or None if there is no such page
+        """
+        prefix = "/" + self.database
+        if path == prefix + CHRONO_LIST:
+            return AUTHORS_PAGE.format("".join(AUTHOR_ROW.format(id=x, name=name)
+                                               for name, x in self.authors.items()))
+        if path.startswith(prefix + WORK_LIST):
+            author = int(path[len(prefix + WORK_LIST):])
+            return WORKS_PAGE.format("".join(WORK_LINK.format(
+                href="{}/public/opere/{}/{}/1".format(prefix, author, i + 1),
+                title="Opus " + chr(ord("A") + i)) for i in range(self.works)))
+        if path.startswith(prefix + "/public/opere/"):
+            author, work, page = [int(x) for x in path.split("/")[-3:]]
+            start = ((author * self.works + work) * self.pages + page) * self.verses
+            records = [self.records[(start + i) % len(self.records)] for i in range(self.verses)]
+            scansions = "".join('<tr><td class="bianco super">{}</td></tr>'.format(
+                to_mqdq(x["scansion"])) for x in records)
+            return PAGE.format(
+                scansions=json.dumps(scansions), delay=self.delay,
+                options="".join('<option value="{0}">{0}</option>'.format(i + 1)
+                                for i in range(self.pages)),
+                id=page, verses="".join('<p class="c_v">{}</p>'.format(x["verse"])
+                                        for x in records))
+        return None
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """ Serves the pages of FixtureHandler.SITE """
+
+    SITE = None
+    LATENCY = 0.0  # number of seconds to wait before responding
+    STATS = {"requests": 0, "not_modified": 0, "concurrent": 0, "max_concurrent": 0}
+    LOCK = threading.Lock()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self.respond(200, json.dumps(FixtureHandler.STATS))
+        with FixtureHandler.LOCK:
+            stats = FixtureHandler.STATS
+            stats["requests"] += 1
+            stats["concurrent"] += 1
+            stats["max_concurrent"] = max(stats["max_concurrent"], stats["concurrent"])
+        try:
+            time.sleep(FixtureHandler.LATENCY)
+            page = FixtureHandler.SITE.get(self.path)
+            if page is None:
+                return self.respond(404, "Not found")
+            etag = '"{}"'.format(hashlib.sha1(page.encode("utf-8")).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                with FixtureHandler.LOCK:
+                    stats["not_modified"] += 1
+                return self.respond(304, "", etag)
+            self.respond(200, page, etag)
+        finally:
+            with FixtureHandler.LOCK:
+                FixtureHandler.STATS["concurrent"] -= 1
+
+    def respond(self, code, text, etag=None):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(site, port, latency=0.0):
+    """
+    Start the stand-in server in a background thread
+    :param site:    FixtureSite
+    :param port:    the port to listen on (0 to pick any free port)
+    :param latency: number of seconds to wait before responding to a request
+    :return:        the server (its address is server.server_address, stop it with shutdown())
+    """
+    FixtureHandler.SITE = site
+    FixtureHandler.LATENCY = latency
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Serve fixture pages that mimic the MqDq database "
+                                            "(run scraping.py with -domain=http://127.0.0.1:PORT/)")
+    p.add_argument("-port", type=int, default=8000, help="the port to listen on")
+    p.add_argument("-database", type=str, default="mqdq", choices=("mqdq", "poetiditalia"),
+                   help="the database name used in the urls")
+    p.add_argument("-scansions", type=str, default=SCANSIONS_FILE,
+                   help="output of scan.py to take the verses and their scansions from")
+    p.add_argument("-authors", type=int, default=2, help="number of authors (at most 26)")
+    p.add_argument("-works", type=int, default=2, help="number of works per author (at most 26)")
+    p.add_argument("-pages", type=int, default=3, help="number of pages per work")
+    p.add_argument("-verses", type=int, default=20, help="number of verses per page")
+    p.add_argument("-delay", type=int, default=500,
+                   help="number of milliseconds after which the scansion appears on a page")
+    p.add_argument("-latency", type=float, default=0.0,
+                   help="number of seconds to wait before responding to a request")
+    args = p.parse_args(sys.argv[1:])
+
+    with open(args.scansions, "r") as file:
+        records = list(json.load(file)["text"].values())
+    site = FixtureSite(args.database, records, args.authors, args.works, args.pages,
+                       args.verses, args.delay)
+    server = serve(site, args.port, args.latency)
+    print("Serving on http://{}:{}/".format(*server.server_address))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
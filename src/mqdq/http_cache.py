@@ -0,0 +1,138 @@
+"""
+This module downloads the pages that scraping.py parses with requests (lists of authors, works
+and pages). All downloads share a pooled session, so connections to the server are reused, and
+responses can be kept in an on-disk cache. Cached responses are revalidated with the server
+(with ETag and Last-Modified headers) once they are older than a given age, and in offline mode
+they are replayed without any network access.
+
+The cache is content-addressed: the body of every response is stored once under its hash, and the
+entry for every url only points to the body and stores the validators
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpCache:
+
+    TIMEOUT = 60  # seconds to wait for the server
+    POOL_SIZE = 16  # maximum number of connections kept open per host
+
+    def __init__(self, dir=None, max_age=0, offline=False):
+        """
+        :param dir:     the directory to keep the cache in. If None, nothing is cached
+        :param max_age: number of seconds during which a cached response is used without
+                        revalidating it with the server
+        :param offline: if True, only cached responses are used (and an error is raised for
+                        urls that are not in the cache)
+        """
+        assert dir or not offline, "offline mode requires a cache directory"
+        self.dir = dir
+        self.max_age = max_age
+        self.offline = offline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HttpCache.POOL_SIZE,
+                              pool_maxsize=HttpCache.POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {"downloaded": 0, "revalidated": 0, "cached": 0}
+
+    def get(self, url):
+        """
+        Return the body of the page at the given url
+        :param url:
+        :return:    bytes
+        """
+        entry = self.__load_entry(url)
+        if entry is not None and (self.offline or time.time() - entry["time"] < self.max_age):
+            self.__count("cached")
+            return self.__load_body(entry["body"])
+        if self.offline:
+            raise KeyError("Not in the cache: " + url)
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.session.get(url, headers=headers, timeout=HttpCache.TIMEOUT)
+        if response.status_code == 304 and entry is not None:
+            self.__count("revalidated")
+            entry["time"] = time.time()
+            self.__save_entry(url, entry)
+            return self.__load_body(entry["body"])
+        response.raise_for_status()
+        self.__count("downloaded")
+        if self.dir:
+            self.__save_entry(url, {"url": url, "time": time.time(),
+                                    "etag": response.headers.get("ETag"),
+                                    "last_modified": response.headers.get("Last-Modified"),
+                                    "body": self.__save_body(response.content)})
+        return response.content
+
+    def __str__(self):
+        return "{downloaded} downloaded, {revalidated} revalidated, {cached} from cache".format(
+            **self.stats)
+
+    def __count(self, outcome):
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def __path(self, kind, key):
+        """
+        Return the file in which an object of the cache is stored
+        :param kind:    "urls" or "bodies"
+        :param key:     the hash of the url or of the body
+        :return:        a path
+        """
+        return os.path.join(self.dir, kind, key[:2], key)
+
+    def __load_entry(self, url):
+        if not self.dir:
+            return None
+        try:
+            with open(self.__path("urls", HttpCache.__hash(url.encode("utf-8"))), "r") as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(self.__path("bodies", entry["body"])):
+            return None
+        return entry
+
+    def __save_entry(self, url, entry):
+        HttpCache.__write(self.__path("urls", HttpCache.__hash(url.encode("utf-8"))),
+                          json.dumps(entry).encode("utf-8"))
+
+    def __load_body(self, key):
+        with open(self.__path("bodies", key), "rb") as file:
+            return file.read()
+
+    def __save_body(self, body):
+        key = HttpCache.__hash(body)
+        if not os.path.exists(self.__path("bodies", key)):
+            HttpCache.__write(self.__path("bodies", key), body)
+        return key
+
+    @staticmethod
+    def __hash(data):
+        return hashlib.sha1(data).hexdigest()
+
+    @staticmethod
+    def __write(filename, data):
+        """
+        Write a file atomically, so that concurrent readers never see a partial file
+        :param filename:
+        :param data:    bytes
+        :return:        None
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = "{}.{}.{}.tmp".format(filename, os.getpid(), threading.get_ident())
+        with open(tmp_filename, "wb") as file:
+            file.write(data)
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides an alternative backend for the MqDq dictionary that is stored in an indexed
+SQLite database. Entries are fetched from disk on demand, so that scanning a text only loads the
+forms that occur in it instead of the whole dictionary.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from functools import lru_cache
+from src.utils import progress
+from src.mqdq.dictionary import MqDqDictionary
+
+
+class IndexedMqDqDictionary(MqDqDictionary):
+
+    EXTENSION = ".sqlite"  # dictionary files with this extension are loaded with this class
+
+    def __init__(self, filename, cache_size=10000):
+        """
+        Open an indexed dictionary created by IndexedMqDqDictionary.convert()
+        :param filename:    the database file
+        :param cache_size:  the number of recently looked up entries to keep in memory
+        """
+        super(IndexedMqDqDictionary, self).__init__()
+        self.filename = filename
+        self.connection = None  # opened on first look up, so that each process opens its own
+        self.pid = None  # the process that opened self.connection
+        self.fetch = lru_cache(maxsize=cache_size)(self.__fetch)
+
+    def load(self, file):
+        raise TypeError("An indexed dictionary is read from disk on demand")
+
+    def save(self, file):
+        raise TypeError("An indexed dictionary can only be created with convert()")
+
+    def look_up(self, form):
+        """
+        Look up a form in the dictionary and return the dictionary entry
+        :param form:
+        :return:
+        """
+        return self.fetch(MqDqDictionary.get_key(form))
+
+    def __fetch(self, key):
+        """
+        Read the entry with the given key from the database
+        :param key:
+        :return:
+        """
+        if self.connection is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(self.filename), uri=True,
+                                              check_same_thread=False)
+        row = self.connection.execute("SELECT entry FROM entries WHERE key = ?",
+                                      (key, )).fetchone()
+        if row is None:
+            return {}
+        return json.loads(row[0])
+
+    @staticmethod
+    def convert(json_file, filename):
+        """
+        Create an indexed dictionary from a dictionary saved by MqDqDictionary.save()
+        :param json_file:   file object from which to read the dictionary
+        :param filename:    the database file to create
+        :return:            None
+        """
+        data = json.load(json_file)
+        connection = sqlite3.connect(filename)
+        with connection:
+            connection.execute("DROP TABLE IF EXISTS entries")
+            connection.execute("CREATE TABLE entries (key TEXT PRIMARY KEY, entry TEXT NOT NULL)")
+            connection.executemany("INSERT INTO entries VALUES (?, ?)",
+                                   ((key, json.dumps(entry))
+                                    for key, entry in progress(data.items())))
+        connection.close()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Convert an MqDq dictionary created by dictionary.py "
+                                            "into an indexed dictionary that can be passed to "
+                                            "scan.py")
+    p.add_argument("input", type=argparse.FileType("r"), help="the dictionary to convert")
+    p.add_argument("output", type=str,
+                   help="output file name (should end with " + IndexedMqDqDictionary.EXTENSION
+                        + ")")
+    args = p.parse_args(sys.argv[1:])
+    IndexedMqDqDictionary.convert(args.input, args.output)
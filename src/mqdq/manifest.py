@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps track of the files from which an MqDq dictionary was built, so that the
+dictionary can be updated incrementally (see MqDqDictionary.augment()). For every file, the
+manifest stores its size, modification time and content hash, as well as the counts the file
+contributed to the dictionary, so that these counts can be subtracted if the file is changed or
+deleted.
+"""
+
+import hashlib
+import json
+import os
+
+
+class Manifest:
+
+    EXTENSION = ".manifest"  # the manifest of a dictionary is saved as its name + EXTENSION
+    VERSION = 1  # increment whenever the format of the manifest or of the dictionary changes
+
+    def __init__(self, diphthongs):
+        """
+        Initialize an empty manifest
+        :param diphthongs:  the setting with which the dictionary is built (see
+                            MqDqDictionary.add_word()). Counts obtained with different settings
+                            cannot be combined
+        """
+        self.diphthongs = diphthongs
+        self.files = {}  # path -> {"author", "size", "mtime", "hash", "counts"}
+        self.dictionary = None  # size and modification time of the saved dictionary
+
+    @staticmethod
+    def load(filename, dictionary_file, diphthongs):
+        """
+        Load the manifest saved alongside a dictionary. An empty manifest is returned if there is
+        no such file, if it was created with different settings, or if the dictionary was
+        modified after the manifest was saved
+        :param filename:        the manifest file
+        :param dictionary_file: the dictionary file the manifest describes
+        :param diphthongs:      see __init__()
+        :return:                a Manifest
+        """
+        manifest = Manifest(diphthongs)
+        try:
+            with open(filename, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return manifest
+        if data["version"] != Manifest.VERSION or data["diphthongs"] != diphthongs:
+            return manifest
+        if not os.path.exists(dictionary_file) or \
+                data["dictionary"] != Manifest.__stat(dictionary_file):
+            return manifest
+        manifest.files = data["files"]
+        manifest.dictionary = data["dictionary"]
+        return manifest
+
+    def save(self, filename, dictionary_file):
+        """
+        Save the manifest. Must be called after the dictionary itself is saved
+        :param filename:        the manifest file
+        :param dictionary_file: the dictionary file the manifest describes
+        :return:                None
+        """
+        self.dictionary = Manifest.__stat(dictionary_file)
+        with open(filename, "w") as file:
+            json.dump({"version": Manifest.VERSION, "diphthongs": self.diphthongs,
+                       "dictionary": self.dictionary, "files": self.files}, file)
+
+    def is_current(self, path, filename, author):
+        """
+        Check whether the counts of a file recorded in the manifest are up to date. The content
+        hash is only computed if the size or the modification time of the file has changed
+        :param path:        the path under which the file is recorded
+        :param filename:    the file on disk
+        :param author:      the author of the text
+        :return:            True, if the file does not need to be counted again
+        """
+        entry = self.files.get(path)
+        if entry is None or entry["author"] != author:
+            return False
+        size, mtime = Manifest.__stat(filename)
+        if entry["size"] == size and entry["mtime"] == mtime:
+            return True
+        if entry["size"] != size or entry["hash"] != Manifest.__hash(filename):
+            return False
+        entry["mtime"] = mtime  # the file was touched but not changed
+        return True
+
+    def record(self, path, filename, author, counts):
+        """
+        Record the counts a file contributed to the dictionary
+        :param path:        the path under which to record the file
+        :param filename:    the file on disk
+        :param author:      the author of the text
+        :param counts:      the data of an MqDqDictionary built from this file alone
+        :return:            None
+        """
+        size, mtime = Manifest.__stat(filename)
+        self.files[path] = {"author": author, "size": size, "mtime": mtime,
+                            "hash": Manifest.__hash(filename), "counts": counts}
+
+    def remove(self, path):
+        """
+        Remove a file from the manifest
+        :param path:    the path under which the file is recorded
+        :return:        the counts the file contributed to the dictionary
+        """
+        return self.files.pop(path)["counts"]
+
+    def paths(self, authors):
+        """
+        Return the paths of all recorded files by the given authors
+        :param authors: a collection of authors
+        :return:        a list of paths
+        """
+        return [path for path, entry in self.files.items() if entry["author"] in authors]
+
+    @staticmethod
+    def __stat(filename):
+        """
+        Return the size and the modification time of a file
+        :param filename:
+        :return: a list [size, mtime in nanoseconds]
+        """
+        stat = os.stat(filename)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def __hash(filename):
+        """
+        Compute the content hash of a file
+        :param filename:
+        :return: a hexadecimal string
+        """
+        with open(filename, "rb") as file:
+            return hashlib.sha1(file.read()).hexdigest()
@@ -0,0 +1,110 @@
+"""
+This module extracts the text and the scansions from the pages downloaded by scraping.py. The
+scraper stores the raw html of every page (compressed) next to the files derived from it, so
+that the derived files can be regenerated offline whenever the parsers in html_parsers.py change:
+
+python -m src.mqdq.parse data/MqDq/ -jobs 8
+"""
+
+import argparse
+import gzip
+import os
+import sys
+from pathlib import Path
+from src.mqdq.html_parsers import PageListParser, PageParser
+from src.utils import positive_int, progress
+
+RAW_EXTENSION = ".html.gz"  # the raw html of page.txt is stored in page.html.gz
+
+
+def raw_file(filename):
+    """
+    Return the file in which the raw html of a page is stored
+    :param filename:    the file with the text of the page (as created by scraping.py)
+    :return:            a path
+    """
+    return filename[:-len(".txt")] + RAW_EXTENSION
+
+
+def save_raw(html, filename):
+    """
+    Store the raw html of a page
+    :param html:        the html as a string
+    :param filename:    the file with the text of the page
+    :return:            None
+    """
+    tmp_file = raw_file(filename) + ".tmp"
+    with gzip.open(tmp_file, "wt", encoding="utf-8") as file:
+        file.write(html)
+    os.replace(tmp_file, raw_file(filename))
+
+
+def write_page(html, filename):
+    """
+    Parse the html of a page and write its text to filename and its scansions (if any) to
+    filename + ".scanned"
+    :param html:        the html as a string
+    :param filename:    the file with the text of the page
+    :return:            None
+    """
+    parser = PageParser()
+    data = parser.feed(html)
+
+    with open(filename, "w") as file:
+        file.writelines(data["text"])
+    if len(data["scansions"]) > 0:
+        with open(filename + ".scanned", "w") as file:
+            file.writelines(data["scansions"])
+    elif os.path.exists(filename + ".scanned"):  # left from a previous version of the parser
+        os.remove(filename + ".scanned")
+
+
+def parse_page(raw):
+    """
+    Regenerate the files derived from a stored page
+    :param raw:     the file with the raw html
+    :return:        the list of the other pages of the same work that have not been downloaded
+    """
+    with gzip.open(raw, "rt", encoding="utf-8") as file:
+        html = file.read()
+    filename = raw[:-len(RAW_EXTENSION)] + ".txt"
+    write_page(html, filename)
+    parser = PageListParser()
+    dir = os.path.dirname(raw)
+    pages = [dir + "/" + page.split("|")[-1] + RAW_EXTENSION for page in parser.feed(html)]
+    return [page for page in pages if not os.path.exists(page)]
+
+
+def parse_all(dir, jobs=1):
+    """
+    Regenerate the files derived from all the pages stored in a directory
+    :param dir:     the directory scraping.py downloaded the pages to
+    :param jobs:    the number of processes to parse the pages with
+    :return:        the set of pages that are listed on the stored pages but were not downloaded
+    """
+    raws = sorted(str(x) for x in Path(dir).rglob("*" + RAW_EXTENSION))
+    missing = set()
+    if jobs == 1:
+        for raw in progress(raws):
+            missing.update(parse_page(raw))
+        return missing
+    from multiprocessing import Pool  # only needed here (scraping.py imports this module)
+    with Pool(jobs) as pool:
+        for pages in progress(pool.imap_unordered(parse_page, raws, chunksize=16), total=len(raws)):
+            missing.update(pages)
+    return missing
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Regenerate the text and the scansions of the pages "
+                                            "downloaded by scraping.py from their raw html")
+    p.add_argument("dir", type=str, help="directory the pages were downloaded to")
+    p.add_argument("-jobs", type=positive_int, default=1,
+                   help="number of processes to parse the pages with")
+    args = p.parse_args(sys.argv[1:])
+
+    missing = parse_all(args.dir, args.jobs)
+    if missing:
+        print("{} pages were not downloaded:".format(len(missing)))
+        for page in sorted(missing):
+            print(page[:-len(RAW_EXTENSION)] + ".txt")
@@ -0,0 +1,110 @@
+"""
+This module schedules concurrent downloads for scraping.py. Pages are put on a work queue and
+processed by a pool of worker threads, each of which owns a separate browser session. Requests
+to the same host are limited both in number (at most so many at a time) and in rate (no two
+requests started closer to each other than a given interval)
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class HostLimiter:
+    """ Limits the number of concurrent requests and the request rate for every host """
+
+    def __init__(self, max_concurrency=2, min_interval=1.0):
+        """
+        :param max_concurrency: maximum number of requests to a host processed at the same time
+        :param min_interval:    minimum number of seconds between the starts of two requests to
+                                the same host
+        """
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.hosts = {}  # host -> [semaphore, time at which the next request can start]
+
+    @contextmanager
+    def slot(self, url):
+        """
+        Block until a request to the host of the url can be started, and hold a slot for that host
+        until the end of the with-statement
+        :param url: the url to be requested
+        :return:    None
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = [threading.BoundedSemaphore(self.max_concurrency), 0.0]
+            entry = self.hosts[host]
+        with entry[0]:
+            with self.lock:
+                start = max(time.monotonic(), entry[1])
+                entry[1] = start + self.min_interval
+            time.sleep(max(0.0, start - time.monotonic()))
+            yield
+
+
+def process_concurrently(tasks, process, create_session, jobs, limiter, set_descr=None):
+    """
+    Process a sequence of pages with a pool of sessions. The tasks are consumed lazily by a
+    separate thread, so that the workers can start before all the tasks are listed
+    :param tasks:           an iterable of tuples (url, filename)
+    :param process:         a function that takes the url, the filename and a session
+    :param create_session:  a function that creates a new session (e.g. a webdriver)
+    :param jobs:            the number of sessions (and worker threads)
+    :param limiter:         HostLimiter
+    :param set_descr:       a function that can be used to report progress
+    :return:                a list of tuples (url, filename, exception) for the failed tasks
+    """
+    work = queue.Queue(maxsize=jobs * 2)
+    failed = []
+    errors = []  # exceptions raised while listing the tasks
+    done = [0]
+    lock = threading.Lock()
+
+    def produce():
+        try:
+            for task in tasks:
+                work.put(task)
+        except Exception as exception:
+            errors.append(exception)
+        finally:
+            for _ in range(jobs):
+                work.put(None)
+
+    def consume(session):
+        while True:
+            task = work.get()
+            if task is None:
+                return
+            try:
+                with limiter.slot(task[0]):
+                    process(task[0], task[1], session)
+            except Exception as exception:
+                print("Failed to download\t{}\t{}\t{}".format(task[0], task[1], exception))
+                with lock:
+                    failed.append(task + (exception, ))
+            with lock:
+                done[0] += 1
+                if set_descr:
+                    set_descr("{} pages".format(done[0]))
+
+    sessions = []
+    try:
+        for _ in range(jobs):
+            sessions.append(create_session())
+        threads = [threading.Thread(target=produce, daemon=True)]
+        threads += [threading.Thread(target=consume, args=(x, ), daemon=True) for x in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for session in sessions:
+            session.quit()
+    if errors:
+        raise errors[0]
+    return failed
@@ -1,22 +1,51 @@
 """ Module for web scraping the mqdq.it database """
 
 import argparse
-import requests
+import os
 import sys
 import pathlib
 
-import urllib3
-from selenium.webdriver.support import wait
-from tqdm import tqdm
-from time import sleep
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
+from time import monotonic, sleep
 from src.mqdq.html_parsers import *
-driver = webdriver.Firefox()
+from src.mqdq.parse import save_raw, write_page
+from src.mqdq.scheduling import HostLimiter, process_concurrently
+from src.utils import positive_int, progress
+# selenium, urllib3 and requests (see http_cache.py) are imported when they are first used, so that
+# importing this module stays fast
+driver = None  # the browser session used by scrap_page() by default (see get_driver())
 
 DOMEN = "http://mizar.unive.it/"
 CHRONO_LIST = "/public/indici/autori/tipo/crono"
 WORK_LIST = "/public/indici/autori/idautori/"
+HTTP = None  # used by download_url() (see get_http()). Replaced in __main__ to enable the cache
+
+# resolves with the index of the first xpath that matches an element, as soon as such an element
+# appears in the document (the page's mutations are observed instead of polling the driver)
+WAIT_SCRIPT = """
+var xpaths = arguments[0], done = arguments[arguments.length - 1];
+function find() {
+    for (var i = 0; i < xpaths.length; i++) {
+        if (document.evaluate(xpaths[i], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE,
+                              null).singleNodeValue) {
+            return i;
+        }
+    }
+    return -1;
+}
+var found = find();
+if (found >= 0) {
+    done(found);
+} else {
+    var observer = new MutationObserver(function() {
+        var found = find();
+        if (found >= 0) {
+            observer.disconnect();
+            done(found);
+        }
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true});
+}
+"""
 
 
 def process_work(url, dir, set_descr=None):
@@ -27,6 +56,20 @@ def process_work(url, dir, set_descr=None):
     :param set_descr:   a function that can be used to set description to the tqdm progress bar
     :return:
     """
+    pages = list_pages(url, dir)
+    for i, (page_url, filename) in enumerate(pages):
+        if set_descr:
+            set_descr(" {}:{}".format(i, len(pages)))
+        scrap_page(page_url, filename)
+
+
+def list_pages(url, dir):
+    """
+    List all the parts of a particular text and create the directory to store them to
+    :param url:         url that leads to the first page corresponding to this work
+    :param dir:         the directory to store all the data to
+    :return:            a list of tuples (url of the page, file to save the page to)
+    """
     pathlib.Path(dir).mkdir(parents=False, exist_ok=True)
     metadata = download_url(url)
     parser = PageListParser()
@@ -34,25 +77,29 @@ def process_work(url, dir, set_descr=None):
     if not pages:  # if there is only one page
         pages = [url.split("/")[-1]]
     baseUrl = url[:-len(url.split("/")[-1])]
-    for i, page in enumerate(pages):
-        set_descr(" {}:{}".format(i, len(pages)))
-        scrap_page(baseUrl + page, dir + "/" + page.split("|")[-1] + ".txt")
+    return [(baseUrl + page, dir + "/" + page.split("|")[-1] + ".txt") for page in pages]
 
 
-def scrap_page(url, filename):
+def scrap_page(url, filename, browser=None):
     """
-    Download all the text from a particular page on MqDq. Also attempt to scan the page
+    Download all the text from a particular page on MqDq. Also attempt to scan the page. The raw
+    html is stored next to the text (see parse.py)
     :param url:
     :param filename:
+    :param browser:     the webdriver to use (the module-level driver by default)
     :return:
     """
-    driver.get(url)
+    import urllib3
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    browser = browser or get_driver()
+    browser.get(url)
     scansionIdLocation = "//input[@name='idScansione' and @type='hidden']"
     livelloIdLocation = "//input[@name='livello' and @type='hidden']"
     try:
-        wait.WebDriverWait(driver, 300).until(lambda x: element_exists(scansionIdLocation))
-        scansionId = driver.find_element_by_xpath(scansionIdLocation).get_attribute('value')
-        scansionId += "," + driver.find_element_by_xpath(livelloIdLocation).get_attribute('value')
+        wait_for_elements(browser, [scansionIdLocation], 300)
+        scansionId = browser.find_element(By.XPATH, scansionIdLocation).get_attribute('value')
+        scansionId += "," + browser.find_element(By.XPATH, livelloIdLocation).get_attribute('value')
     except:
         print("Waiting for page timeout for\t" + url + "\t" + filename)
         scansionId = "0"
@@ -60,10 +107,8 @@ def scrap_page(url, filename):
                      "@onclick='eseguiScansione("+scansionId+")']"
     appearAfterScansion = ["//div[@class='pedecerto']", "//table[@class='versoScandito']"]
     try:
-        driver.find_element_by_xpath(buttonLocation).click()
-        wait.WebDriverWait(driver, 1200).until(
-            lambda x: sum([element_exists(y) for y in appearAfterScansion]) != 0)
-
+        browser.find_element(By.XPATH, buttonLocation).click()
+        wait_for_elements(browser, appearAfterScansion, 1200)
     except TimeoutException:
         print("Waiting for scansion timeout for\t" + url + "\t" + filename)
     except urllib3.exceptions.MaxRetryError:
@@ -72,30 +117,38 @@ def scrap_page(url, filename):
         pass
 
     try:
-        html = driver.page_source
+        html = browser.page_source
     except urllib3.exceptions.MaxRetryError:
         sleep(1800)
-    parser = PageParser()
-    data = parser.feed(html)
+        # if the browser still does not respond, the error is raised and nothing is written, so
+        # that the page is not stored without its html
+        html = browser.page_source
+    save_raw(html, filename)  # so that the page can be parsed again without downloading it
+    write_page(html, filename)
 
-    with open(filename, "w") as file:
-        file.writelines(data["text"])
-    if len(data["scansions"]) > 0:
-        with open(filename + ".scanned", "w") as file:
-            file.writelines(data["scansions"])
 
-
-def element_exists(element):
+def wait_for_elements(browser, elements, timeout):
     """
-    Returns True or False depending on whether an element can be located by the driver
-    :param element:
-    :return:
+    Wait until any of the elements appears on the current page. The wait is restarted if the page
+    is replaced while waiting (e.g. after a form is submitted)
+    :param browser:     the webdriver
+    :param elements:    a list of xpaths
+    :param timeout:     the number of seconds after which to raise a TimeoutException
+    :return:            the index of the element that appeared
     """
-    try:
-        driver.find_element_by_xpath(element)
-    except:
-        return False
-    return True
+    from selenium.common.exceptions import TimeoutException, WebDriverException
+    deadline = monotonic() + timeout
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise TimeoutException("None of the elements appeared: " + ", ".join(elements))
+        browser.set_script_timeout(remaining)
+        try:
+            return browser.execute_async_script(WAIT_SCRIPT, elements)
+        except TimeoutException:
+            raise
+        except WebDriverException:  # the document was unloaded before any element appeared
+            sleep(min(1, max(0, deadline - monotonic())))
 
 
 def process_author(url, dir, set_descr=None):
@@ -106,31 +159,46 @@ def process_author(url, dir, set_descr=None):
     :param set_descr:   a function that can be used to set description to the tqdm progress bar
     :return:
     """
+    works = list_works(url, dir)
+    for i, (work_url, work_dir) in enumerate(works):
+        if set_descr:
+            set_descr_work = lambda x: set_descr("{}:{}".format(i, len(works)) + x)
+        else:
+            set_descr_work = None
+        process_work(work_url, work_dir, set_descr_work)
+
+
+def list_works(url, dir):
+    """
+    List all the works of a particular author and create the directory to store them to. If the
+    directory already exists, the author is skipped
+    :param url:         url that leads to the page that lists all of this author's works
+    :param dir:         the directory to store all the data to
+    :return:            a list of tuples (url of the work, directory to store it to)
+    """
     try:
         pathlib.Path(dir).mkdir(parents=False, exist_ok=False)
     except:
         print("directory " + dir + " already exists. Skipping the corresponding author...")
-        return
+        return []
 
     metadata = download_url(url)
     parser = WorkListParser()
     works_dict = parser.feed(metadata)
-
-    for i, work in enumerate(works_dict.keys()):
-        if set_descr:
-            set_descr_work = lambda x: set_descr("{}:{}".format(i, len(works_dict)) + x)
-        else:
-            set_descr_work = None
-        process_work(DOMEN.rstrip("/") + works_dict[work], dir + "/" + work, set_descr_work)
+    return [(DOMEN.rstrip("/") + works_dict[work], dir + "/" + work) for work in works_dict]
 
 
-def process_all(database, dir, authors_to_download):
+def process_all(database, dir, authors_to_download, jobs=1, per_host=2, interval=1.0):
     """
     Download a databse or a portion of it on the local machine
     :param database:                the database to download (either mqdq or poetiditalia)
     :param dir:                     the directory to store all the data to
     :param authors_to_download:     the list of authors to download or [] if all authors are
                                     to be downloaded
+    :param jobs:                    the number of browser sessions to download pages with. If
+                                    greater than 1, pages are downloaded concurrently
+    :param per_host:                maximum number of pages downloaded from a host at a time
+    :param interval:                minimum number of seconds between two page requests to a host
     :return:                        None
     """
     authors_dict = list_all_authors(database)
@@ -139,7 +207,17 @@ def process_all(database, dir, authors_to_download):
     pathlib.Path(dir).mkdir(parents=False, exist_ok=True)
     if not authors_to_download:
         authors_to_download = list(authors_dict.keys())
-    index = tqdm(authors_to_download)
+    if jobs > 1:
+        index = progress(None, total=None)
+        failed = process_concurrently(
+            list_all_pages(database, dir, authors_to_download, authors_dict),
+            scrap_page, new_driver, jobs, HostLimiter(per_host, interval),
+            lambda x: index.update(1))
+        index.close()
+        if failed:
+            print("{} pages could not be downloaded".format(len(failed)))
+        return
+    index = progress(authors_to_download)
     for author in index:
         author_dir = dir.rstrip("/") + "/" + author
         author_url = DOMEN + database + WORK_LIST + str(authors_dict[author])
@@ -147,6 +225,43 @@ def process_all(database, dir, authors_to_download):
         process_author(author_url, author_dir, set_descr)
 
 
+def list_all_pages(database, dir, authors, authors_dict):
+    """
+    Lazily list all the pages to download for a set of authors
+    :param database:    the database to download (either mqdq or poetiditalia)
+    :param dir:         the directory to store all the data to
+    :param authors:     the list of authors to download
+    :param authors_dict: a dictionary that maps author name to its id (see list_all_authors())
+    :return:            a generator of tuples (url of the page, file to save the page to)
+    """
+    for author in authors:
+        author_dir = dir.rstrip("/") + "/" + author
+        author_url = DOMEN + database + WORK_LIST + str(authors_dict[author])
+        for work_url, work_dir in list_works(author_url, author_dir):
+            for page in list_pages(work_url, work_dir):
+                yield page
+
+
+def get_driver():
+    """
+    Return the module-level browser session, starting it on first use
+    :return: a webdriver
+    """
+    global driver
+    if driver is None:
+        driver = new_driver()
+    return driver
+
+
+def new_driver():
+    """
+    Start a new browser session
+    :return: a webdriver
+    """
+    from selenium import webdriver
+    return webdriver.Firefox()
+
+
 def list_all_authors(database):
     """
     List all authors available for download in a given database
@@ -158,13 +273,25 @@ def list_all_authors(database):
     return parser.feed(metadata)
 
 
+def get_http():
+    """
+    Return the module-level HttpCache, creating it (without an on-disk cache) on first use
+    :return: HttpCache
+    """
+    global HTTP
+    if HTTP is None:
+        from src.mqdq.http_cache import HttpCache
+        HTTP = HttpCache()
+    return HTTP
+
+
 def download_url(url):
     """
     Download url from the web and return html as a string
     :param url: Url to download
     :return:    A string
     """
-    return requests.get(url, stream=True).content.decode("utf-8")
+    return get_http().get(url).decode("utf-8")
 
 
 if __name__ == "__main__":
@@ -175,12 +302,37 @@ if __name__ == "__main__":
                    default="./downloaded")
     p.add_argument("-authors", type=str, nargs="*", default=[],
                    help="particular authors to download")
+    p.add_argument("-jobs", type=positive_int, default=1,
+                   help="number of browser sessions to download pages with concurrently")
+    p.add_argument("-per_host", type=int, default=2,
+                   help="maximum number of pages downloaded from the same host at a time (only "
+                        "used if -jobs is greater than 1)")
+    p.add_argument("-interval", type=float, default=1.0,
+                   help="minimum number of seconds between two page requests to the same host "
+                        "(only used if -jobs is greater than 1)")
+    p.add_argument("-domain", type=str, default=DOMEN,
+                   help="the server to download the database from (e.g. a local server started "
+                        "with fixture_server.py for testing)")
+    p.add_argument("-cache", type=str, default=None,
+                   help="directory to cache the lists of authors, works and pages in (by default, "
+                        "the .http_cache subdirectory of -dir)")
+    p.add_argument("-cache_max_age", type=float, default=3600,
+                   help="number of seconds during which a cached list is used without checking "
+                        "with the server whether it has changed")
+    p.add_argument("--offline", action="store_true", dest="offline",
+                   help="only use the lists in the cache, without connecting to the server")
     p.add_argument("--list-all-authors", action="store_true", dest="list_all_authors",
                    help="instead of downloading the data simply list all the available authors")
-    p.set_defaults(list_all_authors=False)
+    p.set_defaults(list_all_authors=False, offline=False)
     args = p.parse_args(sys.argv[1:])
+    DOMEN = args.domain
+    from src.mqdq.http_cache import HttpCache
+    HTTP = HttpCache(args.cache or os.path.join(args.dir, ".http_cache"), args.cache_max_age,
+                     args.offline)
 
     if args.list_all_authors:
         print(list(list_all_authors(args.database).keys()))
     else:
-        process_all(args.database, args.dir, args.authors)
+        process_all(args.database, args.dir, args.authors, args.jobs, args.per_host,
+                    args.interval)
+    print("Lists of authors, works and pages: " + str(HTTP))
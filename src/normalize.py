@@ -0,0 +1,126 @@
+"""
+This module provides the text normalization routines shared by the MqDq dictionary builder and
+the scanner. All translation tables and regular expressions are built once, when the module is
+imported, so that the routines can be called on every word of a text without recompiling anything
+(as opposed to utils.multireplace() and re.sub() with string patterns).
+"""
+
+import re
+import unicodedata
+
+FOLD_VJ = str.maketrans("vj", "ui")  # consonantal v and j to u and i (see dictionary_key())
+FOLD_UJ = str.maketrans("uj", "vi")  # u to v and j to i (used for word prefixes)
+NOT_LETTER = re.compile("[^a-z]")
+NOT_ASCII_LETTER = re.compile("[^a-zA-Z]")
+SPACES = re.compile(" +")
+DIPHTHONG_MARKS = {"[ae]": "e_", "[oe]": "e_"}  # see remove_diphthongs()
+MQDQ_MARKS = {"_": "̄", "^": "̆", "*": "́"}  # MqDq diacritics for quantity symbols
+QUANTITY = re.compile("([a-z])([_^*])")
+
+
+class Replacer:
+    """
+    A precompiled equivalent of utils.multireplace(). If every string to be replaced is a single
+    character, the replacement is done with str.translate(). Otherwise, a single regular
+    expression that matches longer strings first is compiled
+    """
+
+    def __init__(self, replacements):
+        """
+        :param replacements:    a dictionary {string to find: string to replace it with}
+        """
+        self.replacements = dict(replacements)
+        if all(len(x) == 1 for x in self.replacements):
+            self.table = str.maketrans(self.replacements)
+            self.regex = None
+        else:
+            self.table = None
+            keys = sorted(self.replacements, key=len, reverse=True)
+            self.regex = re.compile("|".join(map(re.escape, keys)))
+
+    def __call__(self, string):
+        """
+        :param string:  the string to execute the replacements on
+        :return:        the replaced string
+        """
+        if self.table is not None:
+            return string.translate(self.table)
+        return self.regex.sub(lambda match: self.replacements[match.group(0)], string)
+
+
+def fold_vj(string):
+    """
+    Replace v with u and j with i
+    :param string:
+    :return:
+    """
+    return string.translate(FOLD_VJ)
+
+
+def dictionary_key(form):
+    """
+    Return the key under which a form (or a word-scansion) is stored in the dictionaries: the
+    lowercase letters of the form with v and j replaced by u and i
+    :param form:
+    :return:
+    """
+    return NOT_LETTER.sub("", form.lower()).translate(FOLD_VJ)
+
+
+def verse_key(verse):
+    """
+    Return the key by which a verse is identified (see Verse.get_verse_key())
+    :param verse:   the verse as it appears in text
+    :return:
+    """
+    return NOT_ASCII_LETTER.sub("", verse).lower().translate(FOLD_VJ)
+
+
+def collapse_spaces(string):
+    """
+    Replace every sequence of spaces with a single space and strip the spaces at both ends
+    :param string:
+    :return:
+    """
+    return SPACES.sub(" ", string).strip(" ")
+
+
+def remove_diphthongs(scansion):
+    """
+    Replace the diphthongs [ae] and [oe] with a long e (see --no_diphthongs option of scan.py)
+    :param scansion:
+    :return:
+    """
+    if "[" not in scansion:
+        return scansion
+    for diphthong, replacement in DIPHTHONG_MARKS.items():
+        scansion = scansion.replace(diphthong, replacement)
+    return scansion
+
+
+def to_mqdq(scansion):
+    """
+    Convert a scansion produced by scan.py to the markup used by MqDq
+    :param scansion:    e.g. " o*pa_ca^ li_nqve*ns"
+    :return:            e.g. "ópācă līnqvéns"
+    """
+    scansion = scansion.replace("[ae]", "æ").replace("[oe]", "œ")
+    scansion = scansion.replace("(", "").replace(")", "")
+    scansion = QUANTITY.sub(lambda match: match.group(1) + MQDQ_MARKS[match.group(2)], scansion)
+    return unicodedata.normalize("NFD", scansion.strip())
+
+
+if __name__ == "__main__":
+    # check the routines against the string-pattern based code they replace
+    from src.utils import multireplace
+
+    assert fold_vj("jvvenis") == multireplace("jvvenis", {"v": "u", "j": "i"}) == "iuuenis"
+    assert dictionary_key("Vir-Jus") == "uirius"
+    assert verse_key("Arma virumque cano, Troiae qui primus ab oris") == \
+        multireplace(re.sub(r"( *[^a-zA-Z] *|[ ]+)", "", "Arma virumque cano, Troiae qui primus "
+                                                           "ab oris").lower(), {"j": "i", "v": "u"})
+    assert collapse_spaces("  arma   virumque ") == "arma virumque"
+    assert remove_diphthongs("m[ae]_st[oe]") == re.sub("(\[ae\]|\[oe\])", "e_", "m[ae]_st[oe]")
+    replacements = {"ab": "AB", "abc": "ABC", "ā": "a_"}
+    assert Replacer(replacements)("hey abc ab ā") == multireplace("hey abc ab ā", replacements)
+    assert Replacer({"u": "v", "j": "i"})("quj") == "qvi"
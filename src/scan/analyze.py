@@ -1,54 +1,85 @@
-from tqdm import tqdm
 from src.scan.meter import Meter
 from src.scan.scansion import Scansion
-from collections import defaultdict
+from src.utils import progress
+from collections import Counter, defaultdict
 import warnings
 
 
-def analyse(data):
+def analyse(verses, quiet=False):
     """
-    Analyze the scanned data and record various statistics such as elision occurrence
-    :param data:
+    Analyze the scanned data and record various statistics such as elision occurrence. The
+    statistics about feet are counted from the decompositions stored by scan.py, which are
+    collected into one array per meter first
+    :param verses:  an iterable of verse records (as written to the output of scan.py)
+    :param quiet:   if True, no message or progress bar is printed
     :return: a dictionary with various statistical measurements
     """
-    print("Analysis in progress...")
+    import numpy as np
+    if not quiet:
+        print("Analysis in progress...")
+        verses = progress(verses)
     stats = defaultdict(dict)
+    stats["global"] = {"elision": Distribution("foot_"), "method": defaultdict(int)}
     dummy_func = lambda *args: None  # function used if look up of a function fails
-    for verse in tqdm(data.values()):
-        meter = Meter.METERS[verse["meter"]]
-        decomposition = meter.decompose(Scansion(verse["scansion"]), turn_off_assertions=True)
-        if len(decomposition) != 1:
-            warnings.warn("Multiple ways to decompose a scansion!")
-        decomposition = decomposition[0]
-        record_global(decomposition, verse, stats["global"])  # record global statistics
-        globals().get("record_" + meter.name, dummy_func)(decomposition, verse, stats[meter.name])
+    feet = {}  # meter name -> the patterns of its verses and the elisions and syllables per foot
+    for verse in verses:
+        stats["global"]["method"][verse["method"]] += 1
+        data = feet.setdefault(verse["meter"], {"patterns": [], "elisions": [], "syllables": []})
+        data["patterns"].append(verse["pattern"])
+        for foot in get_feet(verse):
+            data["elisions"].append(foot.count("("))
+            data["syllables"].append(Scansion(foot).length)
+    for name, data in feet.items():
+        shape = (-1, len(Meter.METERS[name].feet))
+        elisions = np.array(data["elisions"], dtype=int).reshape(shape)
+        syllables = np.array(data["syllables"], dtype=int).reshape(shape)
+        record_global(elisions, stats["global"])  # record global statistics
+        globals().get("record_" + name, dummy_func)(data["patterns"], syllables, stats[name])
     for key in stats:
         globals().get("finalize_" + key, dummy_func)(stats[key])
     return stats
 
 
-def record_trimeterDATI(decomposition, verse, stats):
-    return record_trimeter(decomposition, verse, stats)
+def get_feet(verse):
+    """
+    Return the decomposition of a verse into feet. Records written by older versions of scan.py
+    do not store it, so that it has to be recomputed
+    :param verse:   verse dictionary
+    :return:        a list of strings (empty if the verse was not scanned)
+    """
+    if "feet" in verse:
+        return verse["feet"]
+    meter = Meter.METERS[verse["meter"]]
+    decomposition = meter.decompose(Scansion(verse["scansion"]), turn_off_assertions=True)
+    if len(decomposition) != 1:
+        warnings.warn("Multiple ways to decompose a scansion!")
+    return [str(foot) for foot in decomposition[0]]
+
+
+def record_trimeterDATI(patterns, syllables, stats):
+    return record_trimeter(patterns, syllables, stats)
 
 
-def record_trimeterCORRER(decomposition, verse, stats):
-    return record_trimeter(decomposition, verse, stats)
+def record_trimeterCORRER(patterns, syllables, stats):
+    return record_trimeter(patterns, syllables, stats)
 
 
-def record_trimeter(decomposition, verse, stats):
+def record_trimeter(patterns, syllables, stats):
     """
-    Function called to record statistics about a verse of trimeter
-    :param decomposition:   decomposition of verse into six feet
-    :param verse:           verse dictionary
+    Function called to record statistics about the verses of trimeter
+    :param patterns:        the meter patterns of the verses
+    :param syllables:       an array with the number of syllables in each of the six feet of
+                            every verse that was scanned
     :param stats:           dictionary to fill with statistics
     :return:                None
     """
-    if len(stats) == 0:
-        stats["resolution"] = Distribution("foot_")
-        stats["patterns"] = Distribution("")
-    stats["patterns"].add(verse["pattern"], 1)
-    for i, foot in enumerate(decomposition):
-        stats["resolution"].add(i, len(foot.pattern) - 2)
+    stats["resolution"] = Distribution("foot_")
+    stats["patterns"] = Distribution("")
+    for pattern, count in Counter(patterns).items():
+        stats["patterns"].add(pattern, count)
+    if len(syllables):
+        for i, amount in enumerate((syllables - 2).sum(axis=0)):
+            stats["resolution"].add(i, int(amount))
 
 
 def finalize_trimeterDATI(stats):
@@ -71,20 +102,17 @@ def finalize_trimeter(stats):
     stats["resolution"] = stats["resolution"].data
 
 
-def record_global(decomposition, verse, stats):
+def record_global(elisions, stats):
     """
-    Function called to record global statistics about a verse in the text
-    :param decomposition:   decomposition of verse into six feet
-    :param verse:           verse dictionary
+    Function called to record global statistics about the verses of one meter
+    :param elisions:        an array with the number of elisions in each foot of every verse
+                            that was scanned
     :param stats:           dictionary to fill with statistics
     :return:                None
     """
-    if len(stats) == 0:
-        stats["elision"] = Distribution("foot_")
-        stats["method"] = defaultdict(int)
-    stats["method"][verse["method"]] += 1
-    for i, foot in enumerate(decomposition):
-        stats["elision"].add(i, foot.count_elisions())
+    if len(elisions):
+        for i, amount in enumerate(elisions.sum(axis=0)):
+            stats["elision"].add(i, int(amount))
 
 
 def finalize_global(stats):
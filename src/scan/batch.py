@@ -0,0 +1,70 @@
+"""
+Vectorized matching of many scansions against all the scansions of a meter at once.
+"""
+
+import numpy as np
+
+
+def encode(scansions):
+    """
+    Encode a list of scansions as an integer matrix with one row per scansion and three columns:
+    the number of syllables and the "known" and "long" bitmasks of the scansion (see Scansion)
+    :param scansions:   a list of Scansion objects
+    :return:            a numpy array of shape (len(scansions), 3)
+    """
+    return np.array([(x.length, x.known, x.long) for x in scansions], dtype=np.int64)
+
+
+class BatchMatcher:
+    """ Matches batches of scansions against a fixed set of meter scansions with numpy """
+
+    MAX_LENGTH = 62  # scansions with more syllables than this do not fit into an int64
+
+    def __init__(self, scansions):
+        """
+        Precompute the matrix of meter scansions
+        :param scansions:   an iterable of Scansion objects (the scansions of a meter)
+        """
+        self.scansions = list(scansions)
+        assert max(x.length for x in self.scansions) <= BatchMatcher.MAX_LENGTH
+        self.matrix = encode(self.scansions).T[:, None, :]  # shape (3, 1, number of scansions)
+
+    def match(self, scansions):
+        """
+        Match every scansion in a batch against every meter scansion in a single broadcasted
+        operation. Two scansions match if they have the same number of syllables and their
+        quantities differ only where either of the two syllables is anceps (see Scansion.matches())
+        :param scansions:   a list of Scansion objects
+        :return:            a list of tuples (index of the scansion in the batch, matching
+                            meter Scansion), ordered by the index
+        """
+        ids = [i for i, x in enumerate(scansions) if x.length <= BatchMatcher.MAX_LENGTH]
+        if not ids:
+            return []
+        length, known, long = encode([scansions[i] for i in ids]).T[:, :, None]
+        matches = (length == self.matrix[0]) & \
+                  ((long ^ self.matrix[2]) & known & self.matrix[1] == 0)
+        rows, columns = np.nonzero(matches)
+        return [(ids[row], self.scansions[column]) for row, column in zip(rows, columns)]
+
+
+if __name__ == "__main__":
+    # benchmark the numpy engine against the trie used by Meter.get_matching_scansions()
+    import random
+    import timeit
+    from src.scan.meter import Meter
+    from src.scan.scansion import Scansion
+
+    random.seed(0)
+    meter = Meter.METERS["trimeter"]
+    patterns = [x.pattern for x in meter]
+    matcher = BatchMatcher(meter)
+    print("candidates\tpython (s)\tnumpy (s)")
+    for size in (1, 10, 100, 1000, 10000):
+        batch = ["".join(x if random.random() < 0.8 else random.choice("_^*")
+                         for x in random.choice(patterns)) for _ in range(size)]
+        batch = [Scansion(x) for x in batch]
+        python_time = min(timeit.repeat(
+            lambda: [meter.get_matching_scansions(x) for x in batch], number=1, repeat=3))
+        numpy_time = min(timeit.repeat(lambda: matcher.match(batch), number=1, repeat=3))
+        print("{}\t{:.5f}\t{:.5f}".format(size, python_time, numpy_time))
@@ -0,0 +1,79 @@
+"""
+A command line client for the scan service (see service.py). It takes the same input as scan.py
+and writes the same output, but the verses are scanned by a running service, so that the
+dictionaries do not have to be loaded for every text.
+"""
+
+import argparse
+import datetime
+import json
+import sys
+
+import requests
+
+from src.scan.service import HOST, PORT
+
+TIMEOUT = 600  # seconds to wait for the service to scan a text
+
+
+def scan(url, verses, meter, keys=None, options=None):
+    """
+    Scan verses with the service
+    :param url:     the url of the service
+    :param verses:  a list of strings
+    :param meter:   the name of the meter
+    :param keys:    the keys of the verses in the output (by default, their indices)
+    :param options: a dictionary with some of service.OPTIONS
+    :return:        a dictionary {"text": {key: record}, "stats": ...}, as in the output of scan.py
+    """
+    body = {"meter": meter, "verses": verses, "options": options or {}}
+    if keys is not None:
+        body["keys"] = keys
+    response = requests.post(url.rstrip("/") + "/scan", json=body, timeout=TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError("The service responded with {}: {}".format(
+            response.status_code, response.json().get("error")))
+    return response.json()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Scan a text with a running scan service")
+    p.add_argument("input", type=argparse.FileType("r"),
+                   help="input file with one verse of poetry per line ('-' for standard input). "
+                        "Optionally, the verse can be preceded by a unique index and a tab (see "
+                        "--input_index)")
+    p.add_argument("output", type=argparse.FileType("w"),
+                   help="output file name ('-' for standard output)")
+    p.add_argument("meter", type=str, help="meter to scan the text with")
+    p.add_argument("-url", type=str, default="http://{}:{}/".format(HOST, PORT),
+                   help="the url of the service")
+    p.add_argument("-ac", type=int, default=None, help="see scan.py")
+    p.add_argument("-tc", type=int, default=None, help="see scan.py")
+    p.add_argument("-cutoff", type=float, default=None, help="see scan.py")
+    p.add_argument("-engine", type=str, default=None, help="see scan.py")
+    p.add_argument("-max_candidates", type=int, default=None, help="see scan.py")
+    p.add_argument("-max_seconds", type=float, default=None, help="see scan.py")
+    p.add_argument("-beam_width", type=int, default=None, help="see scan.py")
+    p.add_argument("--precise", dest="precise", action="store_true", help="see scan.py")
+    p.add_argument("--input_index", dest="input_index", action="store_true",
+                   help="assume that the input file contains verse indices and use these indices "
+                        "for output")
+    p.set_defaults(precise=False, input_index=False)
+    args = p.parse_args(sys.argv[1:])
+
+    options = {name: getattr(args, name) for name in ("ac", "tc", "cutoff", "engine",
+                                                      "max_candidates", "max_seconds",
+                                                      "beam_width")
+               if getattr(args, name) is not None}
+    if args.precise:
+        options["precise"] = True
+    lines = [line.rstrip("\n") for line in args.input]
+    if args.input_index:
+        keys, verses = zip(*[line.split("\t") for line in lines]) if lines else ((), ())
+        keys, verses = list(keys), list(verses)
+    else:
+        keys, verses = None, lines
+    data = scan(args.url, verses, args.meter, keys, options)
+    now = datetime.datetime.now()
+    data["createdOn"] = {"day": now.day, "month": now.month, "year": now.year}
+    json.dump(data, args.output, indent=2)
@@ -1,29 +1,124 @@
+import json
+import os
+import sys
 from src.scan.scansion import *
 
 
 class Meter:
     """ Represents a meter as a set of Scansion objects. Supports iterating over these objects. """
 
-    METERS = {}  # dictionary of available meters.
+    METERS = {}  # dictionary of available meters. A meter's scansions are built on first use.
     # Can also contain tuples of Meter objects: METERS["elegiacs"] = (HEXAMETER, PENTAMETER)
+    # to keep built scansions between runs (None to disable):
+    SNAPSHOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), "data", "meters.snapshot")
+    SNAPSHOT_VERSION = 1  # increment whenever the format of the snapshot changes
 
     def __init__(self, feet, name):
         """
-        Initialize a new Meter object from a list of meter patterns of which it is composed.
+        Initialize a new Meter object from a list of meter patterns of which it is composed. The
+        set of scansions is only built when it is first needed (see build())
         :param feet:    a list of meter feet, each of which is a list of possible feet scansions,
                         i.e. a feet of hexameter is (SPONDEE, DACTYL)
         """
-        self.scansions = {EMPTY, }
         self.feet = feet
         self.name = name
         Meter.METERS[name] = self
-        for foot in feet:
-            tmp_scansions = set()
-            for alternative in foot:
-                for existing in self.scansions:
-                    tmp_scansions.add(existing + alternative)
-            self.scansions = tmp_scansions
-        self.__solve_conflicts()
+        self.__scansions = None
+        self.__trie = None
+        self.batch_matcher = None  # built on first use of get_matching_pairs()
+        self.foot_lengths = {}  # meter pattern -> ways to divide it into feet (see decompose())
+
+    @property
+    def scansions(self):
+        if self.__scansions is None:
+            self.build()
+        return self.__scansions
+
+    @property
+    def trie(self):
+        if self.__trie is None:
+            self.build()
+        return self.__trie
+
+    def build(self):
+        """
+        Build the set of scansions of this meter and the trie used to match against them. The
+        scansions are loaded from Meter.SNAPSHOT if this meter was built before with the same
+        feet and the same code (see __code_signature()), and are added to the snapshot otherwise
+        :return: None
+        """
+        signature = json.dumps([[x.scansion for x in foot] for foot in self.feet])
+        snapshot = Meter.__load_snapshot()
+        if signature in snapshot:
+            scansions = {Scansion(x) for x in snapshot[signature]}
+        else:
+            scansions = {EMPTY, }
+            for foot in self.feet:
+                tmp_scansions = set()
+                for alternative in foot:
+                    for existing in scansions:
+                        tmp_scansions.add(existing + alternative)
+                scansions = tmp_scansions
+            scansions = Meter.__solve_conflicts(scansions)
+            snapshot[signature] = [x.scansion for x in scansions]
+            Meter.__save_snapshot(snapshot)
+        self.__scansions = scansions
+        self.__trie = ScansionTrie(scansions)
+
+    @staticmethod
+    def __load_snapshot():
+        """
+        Load the scansions of the meters built in previous runs
+        :return: a dictionary that maps the feet of a meter to the list of its scansions
+        """
+        if not Meter.SNAPSHOT:
+            return {}
+        try:
+            with open(Meter.SNAPSHOT, "r") as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if snapshot.get("version") != Meter.SNAPSHOT_VERSION or \
+                snapshot.get("code") != Meter.__code_signature():
+            return {}
+        return snapshot["meters"]
+
+    @staticmethod
+    def __save_snapshot(meters):
+        """
+        Save the scansions of the meters built so far. Nothing is saved if the snapshot cannot be
+        written (e.g. if the directory does not exist)
+        :param meters:  see __load_snapshot()
+        :return:        None
+        """
+        if not Meter.SNAPSHOT:
+            return
+        tmp_snapshot = "{}.{}.tmp".format(Meter.SNAPSHOT, os.getpid())
+        try:
+            with open(tmp_snapshot, "w") as file:
+                json.dump({"version": Meter.SNAPSHOT_VERSION, "code": Meter.__code_signature(),
+                           "meters": meters}, file)
+            os.replace(tmp_snapshot, Meter.SNAPSHOT)  # so that readers never see a partial file
+        except OSError:
+            pass
+
+    @staticmethod
+    def __code_signature():
+        """
+        Hash the source code that the scansions of a meter are built with (build(),
+        __solve_conflicts() and the scansion module), so that scansions built by an older version
+        of the code are not loaded from the snapshot. The feet themselves are part of the key of
+        every meter in the snapshot (see build())
+        :return:    a string
+        """
+        import hashlib  # imported on first use, so that importing this module stays fast
+        import inspect
+        code = hashlib.sha1()
+        for function in (Meter.build, Meter.__solve_conflicts):
+            code.update(inspect.getsource(function).encode("utf-8"))
+        code.update(inspect.getsource(sys.modules[Scansion.__module__]).encode("utf-8"))
+        return code.hexdigest()
 
     def get_matching_scansions(self, scansion, precise=False):
         """
@@ -32,16 +127,39 @@ class Meter:
         :param precise:  if True, will not use the UNK symbol for ancipites
         :return: a list of Scansion objects
         """
+        return self.trie.match(scansion.pattern, precise)
+
+    def get_matching_pairs(self, scansions, precise=False):
+        """
+        A vectorized version of get_matching_scansions() that matches a whole batch of scansions
+        at once
+        :param scansions:   a list of Scansion objects
+        :param precise:     if True, will not use the UNK symbol for ancipites
+        :return:            a list of tuples (Scansion from scansions, matching Scansion),
+                            in the order of scansions
+        """
+        if self.batch_matcher is None:
+            from src.scan.batch import BatchMatcher  # numpy is only imported if it is used
+            self.batch_matcher = BatchMatcher(self.scansions)
         result = []
-        for meter_scansion in self:
-            if not precise and meter_scansion.matches(scansion):
-                result.append(meter_scansion)
-            elif precise:
-                for precise_meter_scansion in meter_scansion.precise_matchings():
-                    if precise_meter_scansion.matches(scansion):
-                        result.append(precise_meter_scansion)
+        for i, meter_scansion in self.batch_matcher.match(scansions):
+            if not precise:
+                result.append((scansions[i], meter_scansion))
+                continue
+            for precise_meter_scansion in meter_scansion.precise_matchings():
+                if precise_meter_scansion.matches(scansions[i]):
+                    result.append((scansions[i], precise_meter_scansion))
         return result
 
+    def can_begin_with(self, scansion):
+        """
+        Check if any of the scansions in self.scansions begins with the given scansion, i.e.
+        whether the given scansion can be the beginning of a verse written in this meter
+        :param scansion: a Scansion object
+        :return:         a boolean
+        """
+        return self.trie.has_prefix(scansion.pattern)
+
     def decompose(self, scansion, turn_off_assertions=False):
         """
         Decompose a meter pattern into feet. E.g. this line of hexameter: "_^^___^^___^^_*"
@@ -57,41 +175,55 @@ class Meter:
         elif len(pattern) > 1 and turn_off_assertions:
             pattern = [pattern[0]]
         assert len(pattern) == 1
-        scansion = scansion.apply_mask(pattern[0])
-        return self.__recursively_decompose(scansion, 0)
+        return self.divide_into_feet(scansion.apply_mask(pattern[0]))
 
-    def __recursively_decompose(self, scansion, feet_id):
+    def divide_into_feet(self, scansion):
         """
-        A recursive method that performs what is described in the docstirng of decompose()
-        :param scansion: part of the scansion left to decompose
-        :param feet_id:  number of feet already counted in decomposition
-        :return:
+        Decompose a scansion that already has the quantities of one of self.scansions (e.g. one
+        returned by Verse.scan()) into feet without matching it against the meter again. Where the
+        foot boundaries are only depends on the quantities, so that the numbers of syllables in
+        every foot are computed once per meter pattern, and the scansion is then simply split
+        :param scansion:    a Scansion object
+        :return:            a list of lists of Scansion objects (see decompose())
+        """
+        if scansion not in self.foot_lengths:  # Scansion objects with equal quantities are equal
+            self.foot_lengths[Scansion(scansion.pattern)] = \
+                self.__recursively_decompose(Scansion(scansion.pattern), 0)
+        return [scansion.split(lengths) for lengths in self.foot_lengths[scansion]]
+
+    def __recursively_decompose(self, pattern, feet_id):
+        """
+        A recursive method that finds all the ways to divide a meter pattern into feet
+        :param pattern: part of the pattern left to decompose
+        :param feet_id: number of feet already counted in decomposition
+        :return:        a list of tuples with the number of syllables in every foot
         """
         results = []
         for alternative in self.feet[feet_id]:
-            first, second = scansion.divide_by(alternative)
-            if not first:
+            if not pattern.begins_with(alternative):
                 continue
-            if second and feet_id < len(self.feet) - 1:
-                decompositions = self.__recursively_decompose(second, feet_id + 1)
-                for decomposition in decompositions:
-                    results.append([first] + decomposition)
-            elif not second and feet_id == len(self.feet) - 1:
-                results.append([first])
+            if pattern.length > alternative.length and feet_id < len(self.feet) - 1:
+                rest = Scansion(pattern.pattern[alternative.length:])
+                for lengths in self.__recursively_decompose(rest, feet_id + 1):
+                    results.append((alternative.length, ) + lengths)
+            elif pattern.length == alternative.length and feet_id == len(self.feet) - 1:
+                results.append((alternative.length, ))
         return results
 
-    def __solve_conflicts(self):
+    @staticmethod
+    def __solve_conflicts(scansions):
         """
-        Check if any two scansions defining this meter match.
+        Check if any two scansions defining a meter match.
         If they do, replace them with precise scansions (i.e. without ancipites)
-        :return: a boolean
+        :param scansions:   a set of Scansion objects (emptied in the process)
+        :return:            the new set of Scansion objects
         """
         new_scansions = set()
-        while self.scansions:  # for every scansion
-            scansion = self.scansions.pop()
+        while scansions:  # for every scansion
+            scansion = scansions.pop()
             # check if this scansion matches any other scansion in the set
             matches = False
-            for other_scansion in self.scansions:
+            for other_scansion in scansions:
                 if scansion.matches(other_scansion):
                     matches = True
                     break
@@ -100,15 +232,93 @@ class Meter:
                 new_scansions.add(scansion)
                 continue
             # else replace the scansion with precise scansions
-            self.scansions.remove(other_scansion)
+            scansions.remove(other_scansion)
             for precise in scansion.precise_matchings() + other_scansion.precise_matchings():
                 new_scansions.add(precise)
-        self.scansions = new_scansions
+        return new_scansions
 
     def __iter__(self):
         return self.scansions.__iter__()
 
-print("Loading meters...")
+
+class ScansionTrie:
+    """
+    A trie over the quantity symbols (_, ^, and *) built from the scansions of a meter. Allows
+    matching a scansion against all the scansions of the meter in a single pass over its syllables
+    """
+
+    TERMINAL = ""  # key under which the scansions ending at a given node are stored
+
+    def __init__(self, scansions):
+        """
+        Compile a set of Scansion objects into a trie
+        :param scansions: an iterable of Scansion objects
+        """
+        self.root = {}
+        for scansion in scansions:
+            node = self.root
+            for syllable in scansion.pattern:
+                node = node.setdefault(syllable, {})
+            node.setdefault(ScansionTrie.TERMINAL, []).append(scansion)
+
+    def __walk(self, pattern, precise):
+        """
+        Follow all the paths in the trie that match the given pattern. An anceps syllable (*)
+        either in the pattern or in the trie matches a syllable of any length
+        :param pattern: a string of quantity symbols
+        :param precise: if True, record for every path the precise syllables it matched, i.e.
+                        replace every anceps in the trie with the corresponding syllable of the
+                        pattern (or with both long and short, if that syllable is also anceps)
+        :return:        a list of tuples (trie node, precise pattern or "")
+        """
+        states = [(self.root, "")]
+        for syllable in pattern:
+            new_states = []
+            for node, prefix in states:
+                for symbol in "_^*":
+                    child = node.get(symbol)
+                    if child is None or (syllable != symbol and "*" not in (syllable, symbol)):
+                        continue
+                    if not precise:
+                        new_states.append((child, prefix))
+                    elif symbol != "*":
+                        new_states.append((child, prefix + symbol))
+                    elif syllable != "*":
+                        new_states.append((child, prefix + syllable))
+                    else:
+                        new_states += [(child, prefix + "_"), (child, prefix + "^")]
+            states = new_states
+            if not states:
+                break
+        return states
+
+    def match(self, pattern, precise=False):
+        """
+        Return all the scansions in the trie that match the given pattern
+        :param pattern: a string of quantity symbols
+        :param precise: if True, will not use the UNK symbol for ancipites (see
+                        Meter.get_matching_scansions())
+        :return:        a list of Scansion objects
+        """
+        result = []
+        for node, prefix in self.__walk(pattern, precise):
+            if ScansionTrie.TERMINAL not in node:
+                continue
+            if precise:
+                result.append(Scansion(prefix))
+            else:
+                result += node[ScansionTrie.TERMINAL]
+        return result
+
+    def has_prefix(self, pattern):
+        """
+        Check if any of the scansions in the trie begins with syllables matching the given pattern
+        :param pattern: a string of quantity symbols
+        :return:        a boolean
+        """
+        return len(self.__walk(pattern, False)) != 0
+
+
 # disyllabics
 IAMB = SHORT + LONG
 SPONDEE = LONG + LONG
@@ -145,5 +355,11 @@ Meter.METERS["elegiacs"] = (HEXAMETER, PENTAMETER)
 
 if __name__ == "__main__":
     # assertions and checks:
+    line = Scansion("A_rma^ vi^ru_mque^ ca^no_ Tro_j[ae] qui_ pri_mu^s a^b o_ri*s")
+    assert HEXAMETER.get_matching_scansions(line) == [Scansion("_^^_^^_____^^_*")]
+    assert sorted(str(x) for x in HEXAMETER.get_matching_scansions(line, precise=True)) == \
+        ["_^^_^^_____^^_^", "_^^_^^_____^^__"]
+    assert HEXAMETER.can_begin_with(Scansion("_^^_*"))
+    assert not HEXAMETER.can_begin_with(Scansion("_^_"))
     print(HEXAMETER.decompose(Scansion("A_rma^ vi^ru_mque^ ca^no_ "
                                        "Tro_j[ae] qui_ pri_mu^s a^b o_ri*s")))
@@ -0,0 +1,198 @@
+"""
+This module implements the optional profiling of scan.py (see the --profile flag). A Profiler
+times the stages every verse goes through and counts its candidate scansions. The stages are:
+
+words:      building the Word objects of the verse (Verse.__init__())
+macronize:  generating the macronizations of the verse (Verse.macronize())
+match:      matching the macronizations against the meter
+resolve:    choosing between several options automatically (Verse.__resolve_automatically())
+manual:     looking up the manual scansions (Verse.__get_manual_options())
+analyse:    analysing the scanned text (once per run, see analyze.analyse())
+
+When profiling is off, Scanner.profiler is None and the stages are only entered through stage(),
+which then returns a context manager that does nothing.
+"""
+
+from collections import defaultdict
+from contextlib import nullcontext
+import json
+import time
+
+NOT_PROFILING = nullcontext()
+
+
+def stage(profiler, name):
+    """
+    Return a context manager that adds the time spent in it to a stage of the profiler
+    :param profiler:    a Profiler object or None if profiling is off
+    :param name:        the name of the stage
+    :return:            a context manager
+    """
+    return profiler.stage(name) if profiler else NOT_PROFILING
+
+
+class Profiler:
+
+    STAGES = ("words", "macronize", "match", "resolve", "manual", "analyse")
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        self.current = None  # the entry of the verse that is being scanned (see start_verse())
+        self.verses = []  # the entries of the verses scanned so far (see add_verse())
+        self.totals = defaultdict(float)  # seconds spent in every stage
+
+    def start_verse(self, verse):
+        """
+        Start timing a verse. The stages entered until finish_verse() is called are attributed
+        to this verse
+        :param verse:   the verse as it appears in the text
+        :return:        None
+        """
+        self.current = {"verse": verse, "seconds": time.perf_counter(),
+                        "stages": defaultdict(float), "counts": defaultdict(int)}
+
+    def finish_verse(self):
+        """
+        Stop timing the current verse
+        :return:    the entry of the verse: a dictionary with the verse, the seconds it took to
+                    scan it, the seconds spent in every stage and the number of candidates
+        """
+        entry, self.current = self.current, None
+        entry["seconds"] = time.perf_counter() - entry["seconds"]
+        entry["stages"], entry["counts"] = dict(entry["stages"]), dict(entry["counts"])
+        return entry
+
+    def add_verse(self, key, entry):
+        """
+        Record the entry of a scanned verse (possibly returned by a profiler in a different
+        process)
+        :param key:     the key of the verse in the output
+        :param entry:   see finish_verse()
+        :return:        None
+        """
+        self.verses.append(dict(key=key, **entry))
+        for name, seconds in entry["stages"].items():
+            self.totals[name] += seconds
+
+    def stage(self, name):
+        """
+        Return a context manager that adds the time spent in it to a stage
+        :param name:    the name of the stage
+        :return:        a context manager
+        """
+        return Stage(self, name)
+
+    def add_time(self, name, seconds):
+        """
+        Add time to a stage of the current verse (or to the totals if no verse is being scanned)
+        :param name:    the name of the stage
+        :param seconds:
+        :return:        None
+        """
+        if self.current is None:
+            self.totals[name] += seconds
+        else:
+            self.current["stages"][name] += seconds
+
+    def count(self, name, amount):
+        """
+        Add to a counter of the current verse
+        :param name:    the name of the counter (e.g. "options")
+        :param amount:
+        :return:        None
+        """
+        self.current["counts"][name] += amount
+
+    def iterate(self, name, iterable, counter):
+        """
+        Iterate over an iterable, adding the time spent generating the items to a stage
+        :param name:        the name of the stage
+        :param iterable:
+        :param counter:     the name of the counter to add the number of items to
+        :return:            a generator
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            self.count(counter, 1)
+            yield item
+
+    def wrap(self, name, function):
+        """
+        Wrap a function so that the time spent in it is added to a stage
+        :param name:        the name of the stage
+        :param function:
+        :return:            a function
+        """
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def report(self, top=20):
+        """
+        Summarize the recorded data
+        :param top: the number of the slowest verses to include
+        :return:    a dictionary with the total time per stage, the percentiles of time per verse
+                    and of the candidate counts, and the slowest verses
+        """
+        import numpy as np  # imported on first use, so that importing this module stays fast
+        stages = {name: self.totals[name] for name in Profiler.STAGES if name in self.totals}
+        seconds = np.array([x["seconds"] for x in self.verses])
+        # time spent scanning the verses outside of the stages (e.g. decomposing into feet):
+        stages["other"] = float(seconds.sum()) - sum(x for name, x in stages.items()
+                                                     if name != "analyse")
+        report = {"verses": len(self.verses), "stages": stages,
+                  "latency": Profiler.__summarize(seconds)}
+        for counter in ("macronizations", "options"):
+            report[counter] = Profiler.__summarize(
+                np.array([x["counts"].get(counter, 0) for x in self.verses]))
+        report["slowest"] = sorted(self.verses, key=lambda x: x["seconds"], reverse=True)[:top]
+        return report
+
+    def save(self, filename, top=20):
+        """
+        Write the report (see report()) to a JSON file
+        :param filename:
+        :param top:         the number of the slowest verses to include
+        :return:            None
+        """
+        with open(filename, "w") as file:
+            json.dump(self.report(top), file, indent=2)
+
+    @staticmethod
+    def __summarize(values):
+        """
+        :param values:  a numpy array
+        :return:        a dictionary with the mean, the maximum and the percentiles of the values
+        """
+        import numpy as np
+        if len(values) == 0:
+            return {}
+        summary = {"mean": float(values.mean()), "max": float(values.max())}
+        for percentile, value in zip(Profiler.PERCENTILES,
+                                     np.percentile(values, Profiler.PERCENTILES)):
+            summary["p" + str(percentile)] = float(value)
+        return summary
+
+
+class Stage:
+    """A context manager that adds the time spent in it to a stage of a Profiler"""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
@@ -0,0 +1,375 @@
+"""
+This module implements the Scanner, which scans verses with a fixed configuration. A Scanner owns
+everything scanning depends on: the dictionaries, the thresholds, the word caches and the manual
+scansions. Scanners are therefore independent of each other, so that several configurations can
+be used side by side in the same process, and a single Scanner can be kept in a long-running
+process and used for any number of verses and texts. The dictionaries are loaded once per process
+and shared by all the Scanners that use the same files. scan.py is a command line interface to
+Scanner.scan_file().
+
+Verses are scanned either in the current process or in a pool of worker processes, each with its
+own Scanner. Either way, the verses are scanned by the same method and the results are returned
+in the order of the input, so that the output does not depend on the number of processes used.
+"""
+
+import datetime
+from itertools import islice
+import json
+from multiprocessing import Pool
+import os
+import threading
+
+from src.normalize import verse_key
+from src.scan.analyze import analyse
+from src.scan.meter import Meter
+from src.scan.profiling import Profiler, stage
+from src.scan.stream import read_records, resume, skip_completed, write_record, write_summary
+from src.scan.verse import Verse
+from src.scan.word import Word
+from src.scan.word_cache import WordCache
+from src.utils import progress
+
+MORPHEUS_FILE = "data/MorpheusMacrons.txt"
+# command line arguments of scan.py that are passed to Scanner():
+SETTING_NAMES = ("manual_file", "dictionary", "ac", "tc", "cutoff", "precise", "add_failed",
+                 "diphthongs", "engine", "word_cache", "word_cache_size", "profile",
+                 "max_candidates", "max_seconds", "beam_width")
+BATCH_SIZE = 64  # number of verses per worker handed to the pool at once
+# scansion methods of the verses that can have several options, for which the user is prompted
+# in interactive mode:
+RESOLVABLE_FAILURES = ("failed (many options)", "failed (budget)")
+DICTIONARIES = {}  # dictionaries loaded by the current process (see load_dictionary())
+WORKER = None  # the Scanner of a worker process (see _init_worker())
+
+
+def load_dictionary(loader, *args):
+    """
+    Load a dictionary unless it has already been loaded by the current process with the same
+    arguments. The dictionaries are not modified during scanning, so they can be shared
+    :param loader:  Word.load_mqdq_dict or Word.load_morpheus_dict
+    :param args:    the arguments of the loader
+    :return:        the dictionary
+    """
+    key = (loader.__name__, ) + args
+    if key not in DICTIONARIES:
+        DICTIONARIES[key] = loader(*args)
+    return DICTIONARIES[key]
+
+
+class Scanner:
+
+    def __init__(self, dictionary=None, manual_file=None, ac=3, tc=5, cutoff=0.05, precise=False,
+                 add_failed=False, diphthongs=True, engine="python", word_cache=None,
+                 word_cache_size=50000, profile=False, max_candidates=0, max_seconds=0,
+                 beam_width=100, morpheus_file=MORPHEUS_FILE):
+        """
+        Initialize a Scanner. The arguments are described in the help messages of the command line
+        arguments of scan.py with the same names. The manual scansions are read immediately, while
+        the dictionaries are loaded when the first verse is scanned (see load())
+        :param dictionary:      MqDq dictionary file (or None)
+        :param manual_file:     file to read the manual scansions from (or None)
+        :param ac:              minimum number of authors for an MqDq-only scansion of a word
+        :param tc:              minimum number of occurrences for an MqDq-only scansion of a word
+        :param cutoff:          see Verse.__resolve_automatically()
+        :param precise:         whether to allow anceps symbols in the final scansion
+        :param add_failed:      whether to add the verses that could not be scanned to the manual
+                                scansions
+        :param diphthongs:      False if the text has "e" instead of "ae" and "oe"
+        :param engine:          one of Verse.ENGINES
+        :param word_cache:      file to read the word cache from (or None)
+        :param word_cache_size: maximum number of word analyses to keep in memory
+        :param profile:         whether to time the stages of scanning (see profiling.py)
+        :param max_candidates:  see Verse.scan()
+        :param max_seconds:     see Verse.scan()
+        :param beam_width:      see Verse.__beam_macronize()
+        :param morpheus_file:   the Morpheus dictionary file
+        """
+        # the arguments, with which the Scanners of worker processes are created (see scan_many()):
+        self.settings = {"dictionary": dictionary, "manual_file": manual_file, "ac": ac, "tc": tc,
+                         "cutoff": cutoff, "precise": precise, "add_failed": add_failed,
+                         "diphthongs": diphthongs, "engine": engine, "word_cache": word_cache,
+                         "word_cache_size": word_cache_size, "profile": profile,
+                         "max_candidates": max_candidates, "max_seconds": max_seconds,
+                         "beam_width": beam_width, "morpheus_file": morpheus_file}
+        self.dictionary = dictionary
+        self.manual_file = manual_file
+        self.morpheus_file = morpheus_file
+        self.word_cache = word_cache
+        self.author_count = ac
+        self.total_count = tc
+        self.diphthongs = diphthongs
+        self.cutoff = cutoff
+        self.precise = precise
+        self.add_failed = add_failed
+        self.engine = engine
+        self.max_candidates = max_candidates
+        self.max_seconds = max_seconds
+        self.beam_width = beam_width
+        self.profiler = Profiler() if profile else None
+        self.mqdq_dict = None  # see load()
+        self.morpheus_dict = None
+        self.cache = WordCache(word_cache_size)  # analyses of previously encountered words
+        self.mqdq_tables = WordCache()  # see Word.__mqdq_table()
+        # manual scansions. If a verse is in this dictionary, its scansion is taken from here:
+        self.manual = {}
+        self.lock = threading.Lock()  # so that a Scanner can be shared between threads
+        self.read_manual_file(manual_file)
+
+    def load(self):
+        """
+        Load the dictionaries and the word cache file (if they have not been loaded yet)
+        :return:    self
+        """
+        if self.morpheus_dict is None:
+            self.mqdq_dict = load_dictionary(Word.load_mqdq_dict, self.dictionary)
+            self.morpheus_dict = load_dictionary(Word.load_morpheus_dict, self.morpheus_file,
+                                                 self.diphthongs)
+            if self.word_cache:
+                self.cache.load(self.word_cache, self.cache_signature())
+        return self
+
+    def clear_caches(self):
+        """
+        Empty the word caches (e.g. after replacing self.mqdq_dict)
+        :return:    None
+        """
+        self.cache.clear()
+        self.mqdq_tables.clear()
+
+    def cache_signature(self):
+        """
+        Return the signature with which the word cache file is saved (see WordCache.load()). It
+        covers the dictionaries, the settings and the code that analyses words
+        :return:    a list
+        """
+        return [[x, os.path.getmtime(x)] for x in (self.dictionary, self.morpheus_file) if x] + \
+            [self.author_count, self.total_count, self.diphthongs, Word.code_signature()]
+
+    def save_word_cache(self, filename=None):
+        """
+        Save the word cache to a file, so that it can be read by Scanners created later
+        :param filename:    the file (self.word_cache by default)
+        :return:            None
+        """
+        filename = filename or self.word_cache
+        if filename:
+            self.cache.save(filename, self.cache_signature())
+
+    def read_manual_file(self, filename):
+        """
+        Add manually made scansions to self.manual
+        :param filename:    the name of the file from which to extract the manual scansions
+        :return:            None
+        """
+        if not filename:
+            return
+        print("Loading manual scansions...")
+        with open(filename, "r") as file:
+            lines = file.readlines()
+        lines = [line.rstrip("\n").split("\t") for line in lines]
+        for line in lines:
+            key = verse_key(line[0])
+            scansion = Verse.parse_manual_scansion(line[0])
+            if len(line) == 1:
+                self.manual[key] = {"scansion": scansion, "comment": ""}
+            else:
+                self.manual[key] = {"scansion": scansion, "comment": line[1]}
+
+    def save_manual_file(self, filename=None):
+        """
+        Save self.manual to file
+        :param filename:    the name of the file to which to write the data (self.manual_file by
+                            default)
+        :return:            None
+        """
+        filename = filename or self.manual_file
+        if not filename:
+            return
+        tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmp_filename, "w") as file:
+            for value in self.manual.values():
+                file.write(str(value["scansion"]) + "\t" + value["comment"] + "\n")
+        os.replace(tmp_filename, filename)  # so that an interrupted run never leaves a partial file
+
+    def scan_verse(self, verse, meter, interactive=False):
+        """
+        Scan a single verse
+        :param verse:       the verse as it appears in the text
+        :param meter:       the meter to scan the verse with (a Meter or the name of one)
+        :param interactive: whether to prompt the user to select the correct scansion
+        :return:            the dictionary that describes the verse in the output of scan.py. If
+                            profiling is on, it also contains the entry of the verse made by
+                            self.profiler under "profile" (see Profiler.add_verse())
+        """
+        if not isinstance(meter, Meter):
+            meter = Meter.METERS[meter]
+        with self.lock:
+            self.load()
+            record = {"verse": verse}
+            if self.profiler:
+                self.profiler.start_verse(verse)
+            with stage(self.profiler, "words"):
+                verse = Verse(verse, self)
+            scansion, pattern, feet = verse.scan(meter, self.precise, interactive,
+                                                 self.add_failed, self.engine)
+            if scansion:
+                record["scansion"], record["pattern"] = str(scansion), str(pattern)
+                record["feet"] = [str(foot) for foot in feet]
+            else:
+                record["scansion"], record["pattern"], record["feet"] = "", "", []
+            record["confidence"] = verse.confidence
+            record["margin"] = verse.margin
+            record["method"] = verse.scansion_method
+            record["flags"] = verse.flags
+            record["meter"] = meter.name
+            if self.profiler:
+                record["profile"] = self.profiler.finish_verse()
+        return record
+
+    def scan_many(self, tasks, jobs=1, interactive=False):
+        """
+        Scan a sequence of verses, possibly in parallel
+        :param tasks:       an iterable of tuples (key, verse, meter name)
+        :param jobs:        the number of worker processes to use. If 1, verses are scanned by
+                            this Scanner in the current process
+        :param interactive: whether to prompt the user to select the correct scansion. In parallel
+                            mode, the verses for which user input is needed are rescanned by this
+                            Scanner after the workers are done with them
+        :return:            a generator of tuples (key, record), in the order of tasks (see
+                            scan_verse()). The manual scansions added by the workers are added to
+                            self.manual
+        """
+        if jobs < 1:
+            raise ValueError("The number of jobs must be at least 1")
+        if jobs == 1:
+            for key, verse, meter_name in tasks:
+                yield key, self.scan_verse(verse, meter_name, interactive)
+            return
+        tasks = iter(tasks)
+        added = set()  # the keys of the verses whose manual scansions were added during this run
+        with Pool(jobs, initializer=_init_worker, initargs=(self.settings, )) as pool:
+            batch = list(islice(tasks, jobs * BATCH_SIZE))
+            while batch:
+                for key, record, manual_entry in pool.imap(_scan_task, batch, chunksize=8):
+                    manual_key = verse_key(record["verse"])
+                    if manual_key in added or \
+                            (interactive and record["method"] in RESOLVABLE_FAILURES):
+                        # a worker might not have seen the manual scansion added by a previous
+                        # occurrence of the verse, so the verse is rescanned as in serial mode:
+                        record = self.scan_verse(record["verse"], record["meter"], interactive)
+                        added.add(manual_key)
+                    elif manual_entry:
+                        self.manual[manual_entry[0]] = manual_entry[1]
+                        added.add(manual_key)
+                    yield key, record
+                batch = list(islice(tasks, jobs * BATCH_SIZE))
+
+    def scan_file(self, file, output, meter, input_index=False, jobs=1, interactive=False,
+                  stream=False):
+        """
+        Scan a text and write the result along with its analysis (see analyze.analyse()) to a
+        JSON file, as described in README.md. If profiling is on, the data recorded about every
+        verse is added to self.profiler
+        :param file:        a file object with one verse per line
+        :param output:      the name of the output file
+        :param meter:       the name of the meter. If the meter is a tuple of meters (e.g.
+                            elegiacs), the verses are scanned with them in turn
+        :param input_index: whether every line starts with the key of the verse and a tab
+        :param jobs:        see scan_many()
+        :param interactive: see scan_many()
+        :param stream:      whether to write every verse to the output file as soon as it is
+                            scanned (in the JSON Lines format, see stream.py) and to resume
+                            scanning after the last verse already written to the file. In this
+                            case, the manual file is saved whenever a verse written to the output
+                            adds a manual scansion
+        :return:            the statistics (see analyze.analyse())
+        """
+        meters = Meter.METERS[meter]
+        if not isinstance(meters, tuple):  # tuples are used for meters like elegiacs
+            meters = (meters, )
+        tasks = Scanner.__read_tasks(file, meters, input_index)
+        data = {"text": {}}
+        print("Scansion in progress...")
+        if stream:
+            tasks = skip_completed(tasks, resume(output))
+            saved = dict(self.manual)  # the manual scansions as they are in self.manual_file
+            with open(output, "a") as out:
+                for key, record in self.__scan_with_progress(tasks, jobs, interactive):
+                    write_record(out, key, record)
+                    manual_key = verse_key(record["verse"])
+                    if self.manual.get(manual_key) is not saved.get(manual_key):
+                        # so that the scansion is not lost if the run is interrupted and resumed
+                        self.save_manual_file()
+                        saved = dict(self.manual)
+        else:
+            for key, record in self.__scan_with_progress(tasks, jobs, interactive):
+                data["text"][key] = record
+
+        now = datetime.datetime.now()
+        created_on = {"day": now.day, "month": now.month, "year": now.year}
+        if stream:
+            with stage(self.profiler, "analyse"):
+                stats = analyse(read_records(output))
+            with open(output, "a") as out:
+                write_summary(out, stats, created_on)
+            return stats
+        with stage(self.profiler, "analyse"):
+            data["stats"] = analyse(data["text"].values())
+        data["createdOn"] = created_on
+        with open(output, "w") as out:
+            json.dump(data, out, indent=2)
+        return data["stats"]
+
+    def __scan_with_progress(self, tasks, jobs, interactive):
+        """
+        Scan the verses with a progress bar and collect the data about them recorded by the
+        profiler (if any)
+        :param tasks:       see scan_many()
+        :return:            a generator of tuples (key, record)
+        """
+        for key, record in progress(self.scan_many(tasks, jobs, interactive)):
+            if self.profiler:
+                self.profiler.add_verse(key, record.pop("profile"))
+            yield key, record
+
+    @staticmethod
+    def __read_tasks(file, meters, input_index):
+        """
+        Lazily read the verses to scan from a file
+        :param file:        the file object
+        :param meters:      a tuple of Meter objects
+        :param input_index: see scan_file()
+        :return:            a generator of tuples (key, verse, meter name)
+        """
+        for i, line in enumerate(file):
+            if input_index:
+                key, verse = line.rstrip("\n").split("\t")
+            else:
+                key, verse = str(i), line.rstrip("\n")
+            yield key, verse, meters[i % len(meters)].name
+
+
+def _init_worker(settings):
+    """
+    Create the Scanner of a worker process
+    :param settings:    the arguments of Scanner() (see Scanner.settings)
+    :return:            None
+    """
+    global WORKER
+    WORKER = Scanner(**settings)
+
+
+def _scan_task(task):
+    """
+    Scan a verse in a worker process (non-interactively)
+    :param task:    a tuple (key, verse, meter name)
+    :return:        a tuple (key, record, manual entry) where manual entry is the entry the
+                    scansion added to the manual scansions of the worker (or None)
+    """
+    key, verse, meter_name = task
+    manual_key = verse_key(verse)
+    manual_entry = WORKER.manual.get(manual_key)
+    record = WORKER.scan_verse(verse, meter_name)
+    if WORKER.manual.get(manual_key) is manual_entry:
+        return key, record, None
+    return key, record, (manual_key, WORKER.manual[manual_key])
@@ -2,12 +2,22 @@ import re
 
 
 class Scansion:
-    """ Represents a scansion of a piece of text (line, word, etc.)"""
+    """
+    Represents a scansion of a piece of text (line, word, etc.)
+    Internally, the quantities of syllables are stored as two bitmasks (the first syllable being
+    the most significant bit): self.known has a bit set for every syllable of known quantity and
+    self.long - for every long syllable. The text of the scansion is only rendered when requested,
+    so that concatenating Scansion objects is cheap.
+    """
 
     # throughout this code, "_" marks a long syllable, "^" - a short one,
     # and "*" - a syllable of unknown quantity.
     NON_QUANT_SYMBOLS = re.compile("[^\^_*]")
     DIPHTHONG = re.compile("\[[^\]]*\]")  # diphthongs are enclosed with brackets
+    KNOWN_BITS = str.maketrans("_^*", "110")  # translation tables for building the bitmasks
+    LONG_BITS = str.maketrans("_^*", "100")
+
+    __slots__ = ("length", "known", "long", "_scansion", "_pattern", "_left", "_right")
 
     def __init__(self, scansion):
         """
@@ -15,9 +25,56 @@ class Scansion:
         :param scansion: may only contain whitespaces, alphabetic characters,
         _, ^, and * symbols, [...] marking long diphthongs, or (...) marking elided parts of a word
         """
-        self.scansion = scansion
-        self.pattern = Scansion.DIPHTHONG.sub("_", self.scansion)  # replace [] with "long" symbol
-        self.pattern = Scansion.NON_QUANT_SYMBOLS.sub("", self.pattern)  # remove non quant symbols
+        self._scansion = scansion
+        self._left, self._right = None, None
+        pattern = Scansion.DIPHTHONG.sub("_", scansion)  # replace [] with "long" symbol
+        self._pattern = Scansion.NON_QUANT_SYMBOLS.sub("", pattern)  # remove non quant symbols
+        self.length = len(self._pattern)
+        if self.length == 0:
+            self.known, self.long = 0, 0
+        else:
+            self.known = int(self._pattern.translate(Scansion.KNOWN_BITS), 2)
+            self.long = int(self._pattern.translate(Scansion.LONG_BITS), 2)
+
+    @staticmethod
+    def concatenate(left, right):
+        """
+        Create a Scansion object that corresponds to two Scansion objects separated by a whitespace
+        without rendering the text of either of them
+        :param left:    a Scansion object
+        :param right:   a Scansion object
+        :return:        a new Scansion object
+        """
+        result = Scansion.__new__(Scansion)
+        result._scansion, result._pattern = None, None
+        result._left, result._right = left, right
+        result.length = left.length + right.length
+        result.known = (left.known << right.length) | right.known
+        result.long = (left.long << right.length) | right.long
+        return result
+
+    @property
+    def scansion(self):
+        """
+        The text of the scansion, as passed to the initializer
+        :return: a string
+        """
+        if self._scansion is None:
+            self._scansion = self._left.scansion + " " + self._right.scansion
+            self._left, self._right = None, None
+        return self._scansion
+
+    @property
+    def pattern(self):
+        """
+        The quantity symbols of the scansion, e.g. Scansion("a_rma^").pattern is "_^"
+        :return: a string
+        """
+        if self._pattern is None:
+            self._pattern = "".join(("_" if self.long >> i & 1 else "^")
+                                    if self.known >> i & 1 else "*"
+                                    for i in range(self.length - 1, -1, -1))
+        return self._pattern
 
     def matches(self, scansion):
         """
@@ -26,12 +83,8 @@ class Scansion:
         :param scansion:    another Scansion object
         :return:            a boolean
         """
-        if len(self.pattern) != len(scansion.pattern):
-            return False
-        for i, syl in enumerate(self.pattern):
-            if syl != scansion.pattern[i] and syl != "*" and scansion.pattern[i] != "*":
-                return False
-        return True
+        return self.length == scansion.length and \
+            (self.long ^ scansion.long) & self.known & scansion.known == 0
 
     def apply_mask(self, mask):
         """
@@ -42,14 +95,17 @@ class Scansion:
         """
         assert self.matches(mask)
         syllable_id = 0
-        new_scansion = self.scansion
-        for i in range(len(new_scansion)):
-            if new_scansion[i] in "*^_":
-                new_scansion = new_scansion[:i] + mask.pattern[syllable_id] + new_scansion[i + 1:]
-                syllable_id += 1
-            elif new_scansion[i] == "[":  # diphthong
+        new_scansion = []
+        mask_pattern = mask.pattern
+        for char in self.scansion:
+            if char in "*^_":
+                new_scansion.append(mask_pattern[syllable_id])
                 syllable_id += 1
-        return Scansion(new_scansion)
+            else:
+                new_scansion.append(char)
+                if char == "[":  # diphthong
+                    syllable_id += 1
+        return Scansion("".join(new_scansion))
 
     def precise_matchings(self):
         """
@@ -82,10 +138,11 @@ class Scansion:
         :param scansion:    another Scansion object
         :return:            a boolean
         """
-        if len(self.pattern) >= len(scansion.pattern) and \
-                Scansion(self.pattern[:len(scansion.pattern)]).matches(scansion):
-            return True
-        return False
+        if self.length < scansion.length:
+            return False
+        shift = self.length - scansion.length
+        return ((self.long >> shift) ^ scansion.long) & (self.known >> shift) & \
+            scansion.known == 0
 
     def divide_by(self, scansion):
         """
@@ -100,26 +157,43 @@ class Scansion:
         """
         if not self.begins_with(scansion):
             return None, None
-        if len(self.pattern) == len(scansion.pattern):  # scansions have equal number of syllables
+        if self.length == scansion.length:  # scansions have equal number of syllables
             return self, None
-        sylls = len(scansion.pattern)
-        i = 0  # division point
-        while sylls > 0:
-            if self.scansion[i] in "]*_^":
-                sylls -= 1
-            i += 1
-        # Division should happen at word boundary, if possible. If there is a single consonant
-        # between the two vowels, the consonant goes with the second syllable. If there are
-        # more than one, the first consonant goes with the first syllable. This is only a
-        # heuristic for syllable division as there are other things at play, such as prefixes, etc.
-        j = i
-        while self.scansion[j] not in " [" and self.scansion[j+1] not in "_*^":
-            j += 1
-        if self.scansion[j] != " " and j - i > 1:
-            i += 1
-        elif self.scansion[j] == " ":
-            i = j
-        return Scansion(self.scansion[:i]), Scansion(self.scansion[i:])
+        return tuple(self.split((scansion.length, self.length - scansion.length)))
+
+    def split(self, lengths):
+        """
+        Divide self into consecutive parts with the given numbers of syllables. The boundaries
+        are placed in the same way as in divide_by(), e.g.
+        Scansion("a_rma^ vi^ru_mque^ ca^no_").split((3, 2, 2)) returns
+        [Scansion("a_rma^ vi^"), Scansion("ru_mque^"), Scansion(" ca^no_")]
+        :param lengths: a sequence of syllable counts that adds up to self.length
+        :return:        a list of Scansion objects
+        """
+        scansion = self.scansion
+        parts = []
+        start, i = 0, 0  # beginning of the current part and position in scansion
+        for length in lengths[:-1]:
+            while length > 0:
+                if scansion[i] in "]*_^":
+                    length -= 1
+                i += 1
+            # Division should happen at word boundary, if possible. If there is a single consonant
+            # between the two vowels, the consonant goes with the second syllable. If there are
+            # more than one, the first consonant goes with the first syllable. This is only a
+            # heuristic for syllable division as there are other things at play, such as
+            # prefixes, etc.
+            j = i
+            while scansion[j] not in " [" and scansion[j+1] not in "_*^":
+                j += 1
+            if scansion[j] != " " and j - i > 1:
+                i += 1
+            elif scansion[j] == " ":
+                i = j
+            parts.append(Scansion(scansion[start:i]))
+            start = i
+        parts.append(Scansion(scansion[start:]))
+        return parts
 
     def count_elisions(self):
         """
@@ -135,13 +209,14 @@ class Scansion:
         return self.__str__()
 
     def __hash__(self):
-        return self.pattern.__hash__()
+        return hash((self.length, self.known, self.long))
 
     def __eq__(self, other):
-        return self.pattern == other.pattern
+        return self.length == other.length and self.known == other.known and \
+            self.long == other.long
 
     def __add__(self, other):
-        return Scansion(self.scansion + " " + other.scansion)
+        return Scansion.concatenate(self, other)
 
     def __radd__(self, other):
         if isinstance(other, int):
@@ -163,6 +238,8 @@ if __name__ == "__main__":
     patres_l = Scansion("pa_tre_s")
 
     assert patres_l + Scansion("ne^") == patresque_l
+    assert (patres_l + Scansion("ne^")).scansion == "pa_tre_s ne^"
+    assert (patres_l + Scansion("ne^")).pattern == "__^"
 
     assert patresque_u.pattern == "*_^"  # check that pattern is constructed correctly
     assert patresque_u.matches(patresque_l)  # check matches()
@@ -177,3 +254,5 @@ if __name__ == "__main__":
     assert Scansion("ca^no_").divide_by(Scansion("^"))[0].scansion == "ca^"
     assert Scansion("a^b o_ri*s").divide_by(Scansion("^"))[0].scansion == "a^b"
     assert Scansion("a_rma^").divide_by(Scansion("_"))[0].scansion == "a_r"
+    assert [x.scansion for x in Scansion("a_rma^ vi^ru_mque^ ca^no_").split((3, 2, 2))] == \
+        ["a_rma^ vi^", "ru_mque^", " ca^no_"]
@@ -0,0 +1,356 @@
+"""
+This module implements a local scan service: a long-running HTTP server that keeps the
+dictionaries and the meters loaded, so that many short texts can be scanned without paying the
+startup cost of scan.py for each of them (see client.py for the command line client).
+
+The service accepts POST requests to /scan with a JSON body of the following form:
+
+{"meter": "trimeter", "verse": "Opaca linquens Ditis inferni loca", "options": {"cutoff": 0.1}}
+
+The response is the record of the verse, i.e. the fields scan.py writes for it. Instead of
+"verse", the body can contain "verses" (a list of strings) and, optionally, "keys" (a list of the
+same length). The response is then {"text": {key: record}, "stats": ...}, as in the output of
+scan.py. "options" are optional and can contain any of OPTIONS (see the command line arguments
+of scan.py with the same names). GET /health returns the status of the service.
+
+The verses of concurrent requests are collected into micro-batches by a single dispatcher thread,
+which waits up to -batch_wait seconds for a batch to fill up, and every batch is scanned in
+chunks by a pool of worker processes (or in the current process if -jobs is 1).
+"""
+
+import argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+from multiprocessing import Pool
+import queue
+import sys
+import threading
+import time
+
+from src.scan.analyze import analyse
+from src.scan.meter import Meter
+from src.scan.scanner import Scanner
+from src.scan.verse import Verse
+from src.utils import positive_int
+
+HOST = "127.0.0.1"
+PORT = 8765
+# settings of Scanner that can be changed per request and their types (as in scan.py):
+OPTIONS = {"ac": int, "tc": int, "cutoff": float, "precise": bool, "engine": str,
+           "max_candidates": int, "max_seconds": float, "beam_width": int}
+MAX_SCANNERS = 8  # the maximum number of Scanners a process keeps in addition to the default one
+SETTINGS = {}  # the settings with which the current process was initialized (see _init_worker())
+# the Scanners of the current process, one per combination of options, least recently used first.
+# The key of the Scanner with the default settings is ():
+SCANNERS = OrderedDict()
+
+
+def _init_worker(settings):
+    """
+    Initialize a process that scans verses: build all the meters and load the dictionaries
+    :param settings:    the arguments of Scanner()
+    :return:            None
+    """
+    SETTINGS.update(settings)
+    for meter in Meter.METERS.values():
+        if not isinstance(meter, tuple):
+            meter.build()
+    SCANNERS[()] = Scanner(**settings).load()
+
+
+def _get_scanner(options):
+    """
+    Return the Scanner of the current process with the given options. The Scanners share the
+    dictionaries (see scanner.load_dictionary()) and the manual scansions, and those with the
+    default ac and tc also share the word cache. Only the MAX_SCANNERS most recently used Scanners
+    with options other than the defaults are kept
+    :param options: a dictionary with some of OPTIONS
+    :return:        Scanner
+    """
+    key = tuple(sorted(options.items()))
+    if key in SCANNERS:
+        SCANNERS.move_to_end(key)
+        return SCANNERS[key]
+    default = SCANNERS[()]
+    scanner = Scanner(**dict(SETTINGS, manual_file=None, word_cache=None, **options))
+    scanner.manual = default.manual
+    scanner.mqdq_tables = default.mqdq_tables  # these only depend on the dictionaries
+    if (scanner.author_count, scanner.total_count) == (default.author_count, default.total_count):
+        scanner.cache = default.cache
+    SCANNERS[key] = scanner
+    if len(SCANNERS) > MAX_SCANNERS + 1:
+        del SCANNERS[next(x for x in SCANNERS if x != ())]
+    return scanner
+
+
+def _scan_chunk(tasks):
+    """
+    Scan a chunk of a batch. An error is returned in place of the record of the verse that caused
+    it, so that it only fails the request the verse belongs to
+    :param tasks:   a list of tuples (verse, meter name, options)
+    :return:        a list of tuples (record, error), where record is the record of the verse
+                    (see Scanner.scan_verse()) or None and error is None or the description of
+                    the error
+    """
+    results = []
+    for verse, meter, options in tasks:
+        try:
+            results.append((_get_scanner(options).scan_verse(verse, meter), None))
+        except Exception as error:
+            results.append((None, repr(error)))
+    return results
+
+
+class Request:
+    """ The verses of a single request, which the dispatcher scans as part of a batch """
+
+    __slots__ = ("tasks", "records", "error", "done")
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.records = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Batcher:
+    """ Collects the verses of concurrent requests into batches and scans them """
+
+    def __init__(self, settings, jobs=1, batch_size=64, batch_wait=0.01):
+        """
+        Start the worker processes and the dispatcher thread
+        :param settings:    the arguments of Scanner()
+        :param jobs:        the number of worker processes (if 1, verses are scanned in the
+                            dispatcher thread)
+        :param batch_size:  the number of verses at which a batch is scanned without waiting for
+                            more requests
+        :param batch_wait:  the number of seconds to wait for a batch to fill up
+        """
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue()
+        self.batches = 0  # the number of batches scanned so far
+        if jobs == 1:
+            self.pool = None
+            _init_worker(settings)
+        else:
+            self.pool = Pool(jobs, initializer=_init_worker, initargs=(settings, ))
+        threading.Thread(target=self.__dispatch, daemon=True).start()
+
+    def scan(self, tasks):
+        """
+        Scan verses as part of the next batch and wait for the result
+        :param tasks:   a list of tuples (verse, meter name, options)
+        :return:        a list of records (see Scanner.scan_verse())
+        """
+        request = Request(tasks)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.records
+
+    def close(self):
+        """
+        Stop the worker processes
+        :return:    None
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+
+    def __dispatch(self):
+        """
+        Collect requests into batches and scan them, one batch at a time
+        :return:    None
+        """
+        while True:
+            requests = [self.queue.get()]
+            size = len(requests[0].tasks)
+            deadline = time.perf_counter() + self.batch_wait
+            while size < self.batch_size:
+                try:
+                    requests.append(self.queue.get(timeout=max(0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+                size += len(requests[-1].tasks)
+            try:
+                records = self.__scan_batch([task for x in requests for task in x.tasks])
+            except Exception as error:
+                for request in requests:
+                    request.error = RuntimeError(repr(error))
+                    request.done.set()
+                continue
+            self.batches += 1
+            for request in requests:
+                results, records = records[:len(request.tasks)], records[len(request.tasks):]
+                errors = [error for _, error in results if error is not None]
+                if errors:
+                    request.error = RuntimeError(errors[0])
+                else:
+                    request.records = [record for record, _ in results]
+                request.done.set()
+
+    def __scan_batch(self, tasks):
+        """
+        Scan a batch of verses, splitting it into chunks among the worker processes
+        :param tasks:   a list of tuples (verse, meter name, options)
+        :return:        a list of tuples (record, error) in the order of tasks (see _scan_chunk())
+        """
+        if self.pool is None:
+            return _scan_chunk(tasks)
+        size = max(1, min(self.batch_size, math.ceil(len(tasks) / self.jobs)))
+        chunks = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+        return [record for chunk in self.pool.map(_scan_chunk, chunks) for record in chunk]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Handles the requests to the service (see the module docstring) """
+
+    batcher = None  # set by serve()
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.__respond(404, {"error": "Unknown path: " + self.path})
+        self.__respond(200, {"status": "ok", "jobs": self.batcher.jobs,
+                             "batches": self.batcher.batches, "meters": list(Meter.METERS)})
+
+    def do_POST(self):
+        if self.path != "/scan":
+            return self.__respond(404, {"error": "Unknown path: " + self.path})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            tasks, keys = Handler.__parse(body)
+        except (ValueError, KeyError, TypeError) as error:
+            return self.__respond(400, {"error": str(error)})
+        try:
+            records = self.batcher.scan(tasks)
+        except Exception as error:
+            return self.__respond(500, {"error": str(error)})
+        if keys is None:
+            return self.__respond(200, records[0])
+        self.__respond(200, {"text": dict(zip(keys, records)),
+                             "stats": analyse(records, quiet=True)})
+
+    def __respond(self, status, data):
+        """
+        Send a JSON response
+        :param status:  the HTTP status code
+        :param data:    the body of the response
+        :return:        None
+        """
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def __parse(body):
+        """
+        Validate the body of a request to /scan and convert it into tasks
+        :param body:    the decoded JSON body
+        :return:        a tuple (tasks, keys), where tasks is a list of tuples (verse, meter name,
+                        options) and keys is None if a single verse was sent
+        """
+        if not isinstance(body, dict):
+            raise ValueError("The body must be a JSON object")
+        if body.get("meter") not in Meter.METERS:
+            raise ValueError("Unknown meter: " + str(body.get("meter")))
+        meters = Meter.METERS[body["meter"]]
+        if not isinstance(meters, tuple):  # tuples are used for meters like elegiacs
+            meters = (meters, )
+        options = Handler.__parse_options(body.get("options", {}))
+        if "verse" in body:
+            if not isinstance(body["verse"], str):
+                raise ValueError("\"verse\" must be a string")
+            return [(body["verse"], meters[0].name, options)], None
+        verses = body.get("verses")
+        if not isinstance(verses, list) or not all(isinstance(x, str) for x in verses):
+            raise ValueError("\"verses\" must be a list of strings")
+        keys = body.get("keys", list(range(len(verses))))
+        if not isinstance(keys, list):
+            raise ValueError("\"keys\" must be a list")
+        if len(keys) != len(verses):
+            raise ValueError("The number of keys does not match the number of verses")
+        return [(verse, meters[i % len(meters)].name, options)
+                for i, verse in enumerate(verses)], [str(x) for x in keys]
+
+    @staticmethod
+    def __parse_options(options):
+        """
+        Validate the options of a request to /scan
+        :param options: the decoded "options" of the request
+        :return:        a dictionary with some of OPTIONS, converted to their types
+        """
+        if not isinstance(options, dict):
+            raise ValueError("\"options\" must be a JSON object")
+        unknown = [x for x in options if x not in OPTIONS]
+        if unknown:
+            raise ValueError("Unknown options: " + ", ".join(unknown))
+        result = {}
+        for name, value in options.items():
+            kind = OPTIONS[name]
+            # bool is a subclass of int, and JSON integers are accepted where floats are expected:
+            if isinstance(value, bool) != (kind is bool) or \
+                    not isinstance(value, (int, float) if kind is float else kind):
+                raise ValueError("Option {} must be of type {}".format(name, kind.__name__))
+            result[name] = kind(value)
+        if result.get("engine", Verse.ENGINES[0]) not in Verse.ENGINES:
+            raise ValueError("Unknown scansion engine: " + result["engine"])
+        return result
+
+def serve(settings, host=HOST, port=PORT, jobs=1, batch_size=64, batch_wait=0.01):
+    """
+    Run the service until it is interrupted
+    :param settings:    the arguments of Scanner() (the defaults for every request)
+    :param host:        the address to listen on
+    :param port:        the port to listen on
+    :param jobs:        see Batcher()
+    :param batch_size:  see Batcher()
+    :param batch_wait:  see Batcher()
+    :return:            None
+    """
+    Handler.batcher = Batcher(settings, jobs, batch_size, batch_wait)
+    server = ThreadingHTTPServer((host, port), Handler)
+    print("Listening on http://{}:{}/".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        Handler.batcher.close()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Run a local scan service that keeps the dictionaries "
+                                            "loaded (see client.py)")
+    p.add_argument("-host", type=str, default=HOST, help="address to listen on")
+    p.add_argument("-port", type=int, default=PORT, help="port to listen on")
+    p.add_argument("-manual_file", type=str, default=None,
+                   help="file from which to read manual scansions (it is not modified)")
+    p.add_argument("-dictionary", type=str, default=None,
+                   help="MQDQ dictionary file to use during scansion (see scan.py)")
+    p.add_argument("-word_cache", type=str, default=None,
+                   help="file from which to read the word cache (see scan.py)")
+    p.add_argument("-word_cache_size", type=int, default=50000,
+                   help="maximum number of word analyses every worker keeps in memory")
+    p.add_argument("-jobs", type=positive_int, default=1,
+                   help="number of worker processes to scan the verses with")
+    p.add_argument("-batch_size", type=int, default=64,
+                   help="number of verses at which a batch is scanned without waiting for more "
+                        "requests")
+    p.add_argument("-batch_wait", type=float, default=0.01,
+                   help="number of seconds to wait for more requests before scanning a batch")
+    p.add_argument("--no_diphthongs", dest="diphthongs", action="store_false",
+                   help="see scan.py (this applies to all requests)")
+    p.set_defaults(diphthongs=True)
+    args = p.parse_args(sys.argv[1:])
+    serve({"dictionary": args.dictionary, "manual_file": args.manual_file,
+           "word_cache": args.word_cache, "word_cache_size": args.word_cache_size,
+           "diphthongs": args.diphthongs},
+          args.host, args.port, args.jobs, args.batch_size, args.batch_wait)
@@ -0,0 +1,114 @@
+"""
+This module implements the streaming output mode of scan.py. In this mode, the output file is in
+the JSON Lines format: every verse is written as a separate JSON record as soon as it is scanned,
+and the last line contains the statistics and the creation date. An interrupted run can be
+resumed from the last verse written to the file.
+"""
+
+import json
+import os
+
+RECORD_START = b'{"key": '  # the beginning of every line written by write_record()
+
+
+def write_record(file, key, record):
+    """
+    Append the record of a scanned verse to the output file
+    :param file:    a file opened for writing
+    :param key:     the key of the verse
+    :param record:  the dictionary that describes the verse (see Scanner.scan_verse())
+    :return:        None
+    """
+    file.write(json.dumps(dict(key=key, **record)) + "\n")
+    file.flush()
+
+
+def write_summary(file, stats, created_on):
+    """
+    Append the final line with the statistics to the output file
+    :param file:        a file opened for writing
+    :param stats:       the statistics (see analyze.analyse())
+    :param created_on:  the creation date
+    :return:            None
+    """
+    file.write(json.dumps({"stats": stats, "createdOn": created_on}) + "\n")
+
+
+def read_records(filename):
+    """
+    Read the records of the scanned verses from the output file one by one
+    :param filename:    the name of the output file
+    :return:            a generator of dictionaries
+    """
+    with open(filename, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            if "key" in record:
+                yield record
+
+
+def resume(filename):
+    """
+    Prepare an output file for resuming an interrupted run: remove a partially written last line
+    or the line with the statistics from the end of the file. Nothing else is ever removed. The
+    file is read line by line, so that resuming a large output does not take more memory
+    :param filename:    the name of the output file
+    :return:            the key of the last verse written to the file or None if there is none
+    """
+    if not os.path.exists(filename):
+        return None
+    error = "Cannot resume: line {} of " + filename + " is not a verse written by --stream"
+    last_key, end = None, 0  # end is the offset right after the last verse
+    tail = None  # a tuple (line number, line, record) for a line that is not a verse
+    with open(filename, "rb") as file:
+        for number, line in enumerate(file, 1):
+            if tail is not None:  # only the last line may not be a verse
+                raise ValueError(error.format(tail[0]))
+            record = parse_line(line)
+            if record is not None and "key" in record:
+                last_key, end = record["key"], end + len(line)
+            else:
+                tail = (number, line, record)
+    if tail is not None:
+        number, line, record = tail
+        is_partial = not line.endswith(b"\n") and line.startswith(RECORD_START)
+        is_summary = record is not None and "stats" in record
+        if not (is_partial or is_summary):
+            raise ValueError(error.format(number))
+    with open(filename, "rb+") as file:
+        file.truncate(end)
+    return last_key
+
+
+def parse_line(line):
+    """
+    Decode a complete line of the output file
+    :param line:    bytes
+    :return:        a dictionary or None if the line is incomplete or not a JSON object
+    """
+    if not line.endswith(b"\n"):
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def skip_completed(tasks, last_key):
+    """
+    Skip the tasks up to and including the verse with the given key
+    :param tasks:       an iterable of tuples (key, verse, meter name)
+    :param last_key:    the key of the last verse already scanned or None
+    :return:            an iterator over the remaining tasks
+    """
+    tasks = iter(tasks)
+    if last_key is None:
+        return tasks
+    for key, _, _ in tasks:
+        if key == last_key:
+            break
+    else:
+        raise ValueError("Cannot resume: the last verse in the output file (" + last_key +
+                         ") is not in the input")
+    return tasks
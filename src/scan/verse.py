@@ -1,8 +1,11 @@
 from src.scan.word import Word
 from src.scan.scansion import Scansion
 from src.utils import *
+from src.normalize import NOT_LETTER, collapse_spaces, verse_key
+from src.scan.profiling import stage
 import math
-from copy import deepcopy
+import time
+from itertools import islice
 import warnings
 import re
 
@@ -10,66 +13,98 @@ import re
 class Verse:
     """ Represents a single verse of poetry """
 
-    DICT = {}  # dictionary of manual scansion. If a verse is in the dictionary, the scansion
-    # returned by scan() will be from this dictionary
-    CUTOFF = 0.05  # see scan.py command line argument description
+    ENGINES = ("python", "numpy")  # ways to match macronizations against the meter, see scan()
+    BATCH_SIZE = 1024  # number of macronizations matched at once by the "numpy" engine
+    NOT_SCANSION = re.compile(r"([^a-z_\^*\[\]()])")  # characters not used in manual scansions
 
-    def __init__(self, verse):
+    def __init__(self, verse, scanner):
         """
         Initialize a new Verse object from a string
         :param verse:   a verse of poetry (may contain any symbols including punctuation signs)
+        :param scanner: the Scanner that provides the dictionaries, the manual scansions (in
+                        scanner.manual) and the settings (see scanner.py)
         """
+        self.scanner = scanner
         self.unaltered = verse
         self.verse_key = Verse.get_verse_key(verse)
-        verse = re.sub(r"([^a-z])", " ", verse.lower()).rstrip(" ").lstrip(" ")
-        verse = re.sub(" +", " ", verse).split(" ")
-        self.words = [Word(verse[-1], None)]
+        verse = collapse_spaces(NOT_LETTER.sub(" ", verse.lower())).split(" ")
+        self.words = [Word(verse[-1], None, scanner)]
         for i in range(len(verse) - 2, -1, -1):  # in reverse order because of how elision works
-            self.words.insert(0, Word(verse[i], self.words[0]))
-        self.__macronize()
+            self.words.insert(0, Word(verse[i], self.words[0], scanner))
         self.flags = []
+        self.posterior = []  # scansion options with their probabilities, see score_options()
+        self.budget_exceeded = False  # whether scan() had to fall back on the beam search
 
-    def __macronize(self):
+    def macronize(self, meter, deadline=None):
         """
-        Populate self.macronizations, with all possible ways the line can be macronized
-        :return:
+        Generate all possible ways the line can be macronized that can be consistent with the meter.
+        The words are macronized from left to right and a partial macronization is discarded as
+        soon as no scansion of the meter begins with it, so that the full cartesian product of
+        word macronizations is never built. Macronizations are generated in the same order as they
+        would appear in that cartesian product
+        :param meter:       the meter to use as a constraint
+        :param deadline:    the time.perf_counter() value after which generation stops and
+                            self.budget_exceeded is set (None for no limit). The time is checked
+                            for every partial macronization, so that a verse whose partial
+                            macronizations are almost all discarded cannot exceed it either
+        :return:            a generator of Scansion objects
         """
-        self.macronizations = [Scansion("")]
-        for i, word in enumerate(self.words):
-            new_macrons = []
-            for exist in self.macronizations:
-                for macrons in word.macronize():
-                    new_macrons.append(exist + macrons)
-            self.macronizations = new_macrons
+        word_macronizations = [word.macronize() for word in self.words]
+        return self.__recursively_macronize(Scansion(""), word_macronizations, 0, meter,
+                                            deadline)
 
-    def score_scansions(self, scansion1, scansion2):
+    def __recursively_macronize(self, prefix, word_macronizations, word_id, meter, deadline):
         """
-        Take two scansions a and b.
-        For each word i compute p(i_a) and p(i_b),
-        probabilities that word i would be scanned as in a and b respectively.
-
-        Compute p(a) as the product of p(i_a)'s and p(b) as the product of p(i_b)'s
-
-        Return the most likely of the two scansions and
-        either p(a)/(p(a) + p(b)) or p(b) / (p(a) + p(b)), whichever is greater.
-
-        Note that the actual computation is somewhat simplified.
+        A recursive generator that performs what is described in the docstring of macronize()
+        :param prefix:              macronization of the words preceding word_id
+        :param word_macronizations: a list of lists of possible macronizations of each word
+        :param word_id:             the index of the word to macronize next
+        :param meter:               the meter to use as a constraint
+        :param deadline:            see macronize()
+        :return:                    a generator of Scansion objects
+        """
+        if word_id == len(word_macronizations):
+            yield prefix
+            return
+        for macrons in word_macronizations[word_id]:
+            if deadline is not None and time.perf_counter() > deadline:
+                self.budget_exceeded = True
+            if self.budget_exceeded:
+                return
+            new_prefix = prefix + macrons
+            if meter.can_begin_with(new_prefix):
+                yield from self.__recursively_macronize(new_prefix, word_macronizations,
+                                                        word_id + 1, meter, deadline)
 
-        :param scansion1: the first scansion (a)
-        :param scansion2: the second scansion (b)
-        :return:          a Scansion (either a or b), a float that lies in (0.5, 1)
-        """
-        p_1 = 1
-        p_2 = 1
-        word_scansions_1 = scansion1.scansion.lstrip(" ").rstrip(" ").split(" ")
-        word_scansions_2 = scansion2.scansion.lstrip(" ").rstrip(" ").split(" ")
+    def score_options(self, options):
+        """
+        Compute the posterior probability of every scansion option.
+        For every word i and option a, the probability that word i would be scanned as in a is
+        estimated as n(i_a) / Z_i, where n(i_a) is the number of times word i is scanned in the
+        MqDq dictionary in a way that matches a but none of the other ways the options scan it,
+        and Z_i is the sum of n(i_b) over all options b (one is added to every n(i_b) if any of
+        them is zero). The probability of an option is proportional to the product of the
+        probabilities of its words. With two options, this is the pairwise comparison of
+        scansions used by earlier versions. The computation is done in log space for all options
+        and words at once, so that long lines do not underflow and the result does not depend on
+        the order of options.
+        :param options: a collection of Scansion objects
+        :return:        a list of tuples (Scansion, float), sorted by decreasing probability
+        """
+        import numpy as np  # imported on first use, so that importing this module stays fast
+        options = sorted(options, key=str)
+        words = [option.scansion.lstrip(" ").rstrip(" ").split(" ") for option in options]
+        word_counts = np.ones((len(options), len(self.words)))
         for i, word in enumerate(self.words):
-            p_word_1, _ = word.compare_scansions(word_scansions_1[i], word_scansions_2[i])
-            p_1 *= p_word_1
-            p_2 *= (1 - p_word_1)
-        if p_1 > p_2:
-            return scansion1, p_1/(p_1 + p_2)
-        return scansion2, p_2 / (p_1 + p_2)
+            scansions = sorted({x[i] for x in words})
+            if len(scansions) > 1:  # otherwise the word does not tell the options apart
+                counts = dict(zip(scansions, word.count_distinct_scansions(scansions)))
+                word_counts[:, i] = [counts[x[i]] for x in words]
+        word_counts += (word_counts == 0).any(axis=0)
+        log_p = np.log(word_counts / word_counts.sum(axis=0)).sum(axis=1)
+        posterior = np.exp(log_p - log_p.max())
+        posterior /= posterior.sum()
+        return [(options[j], float(posterior[j])) for j in np.argsort(-posterior, kind="stable")]
 
     def update_flags(self, scansion):
         """
@@ -86,61 +121,207 @@ class Verse:
             if self.words[i].is_new:
                 self.flags.append("A previuosly unencountered word: " + macrons)
 
-    def scan(self, meter, precise=False, interactive=True, add_failed=False):
+    def scan(self, meter, precise=False, interactive=True, add_failed=False, engine="python"):
         """
-        Return the scansion for this line or None if correct scansion cannot be determined
+        Scan this line and return its scansion along with the meter pattern it matches and its
+        decomposition into feet, so that these do not have to be recomputed later (see
+        analyze.analyse())
         :param meter:       the meter to use as a constraint for the scansion
         :param precise:     whether to allow anceps symbols in the final scansion
         :param interactive: whether to prompt the user to select the correct scansion when
                             several options are available
         :param add_failed:  If True, the lines that the program failed to scan will be added
-                            to Verse.DICT, so that they can later be scanned manually in the
-                            manual file
-        :return:            Scansion object or None
+                            to scanner.manual, so that they can later be scanned manually in
+                            the manual file
+        :param engine:      one of Verse.ENGINES. "python" matches macronizations against the
+                            meter one by one, "numpy" matches them in batches (faster for verses
+                            with many macronizations)
+        If generating the macronizations exceeds the budget (scanner.max_candidates or
+        scanner.max_seconds), only the most frequent ones are considered (see __beam_macronize())
+        and the scansion method is "beam" or "failed (budget)"
+        :return:            a tuple (scansion, pattern, feet) of a Scansion object, the matching
+                            Scansion object from the meter and a list of Scansion objects (one per
+                            foot) or (None, None, None) if correct scansion cannot be determined
         """
-        options = set()
-        for i, macronization in enumerate(self.macronizations):
-            meter_patterns = meter.get_matching_scansions(macronization, precise)
-            for pattern in meter_patterns:
-                scansion = macronization.apply_mask(pattern)
-                options.add(scansion)
-                # TODO consider a very rare but theoretically possible case, when to scansions are
-                # the same, but words are macronized diffrently
+        self.posterior = []
+        self.budget_exceeded = False
+        profiler = self.scanner.profiler
+        deadline = None
+        if self.scanner.max_seconds:
+            deadline = time.perf_counter() + self.scanner.max_seconds
+        macronizations = self.macronize(meter, deadline)
+        if self.scanner.max_candidates or deadline is not None:
+            macronizations = self.__within_budget(macronizations, deadline)
+        options, patterns = self.__find_options(meter, precise, engine, macronizations)
+        if self.budget_exceeded:
+            options, patterns = self.__find_options(meter, precise, engine,
+                                                    self.__beam_macronize(meter))
 
-        manual_options = self.__get_manual_options(meter, precise)
+        if profiler:
+            profiler.count("options", len(options))
+        if len(options) == 1:
+            self.posterior = [(scansion, 1.0) for scansion in options]
+        with stage(profiler, "manual"):
+            manual_options = self.__get_manual_options(meter, precise, patterns)
         if len(options) > 1 and len(manual_options) != 1:
             options = self.__resolve(options, interactive)
-        return self.__finish_scansion(options, manual_options, add_failed)
+        scansion = self.__finish_scansion(options, manual_options, add_failed)
+        if self.budget_exceeded and self.scansion_method.startswith("failed"):
+            self.scansion_method = "failed (budget)"
+        elif self.budget_exceeded and self.scansion_method == "automatic":
+            self.scansion_method = "beam"
+        if scansion is None:
+            return None, None, None
+        decompositions = meter.divide_into_feet(scansion)
+        if len(decompositions) != 1:
+            warnings.warn("Multiple ways to decompose a scansion!")
+        return scansion, patterns[scansion], decompositions[0] if decompositions else []
+
+    def __find_options(self, meter, precise, engine, macronizations):
+        """
+        Match macronizations of this line against the meter
+        :param meter:           the meter to use as a constraint for the scansion
+        :param precise:         whether to allow anceps symbols in the final scansion
+        :param engine:          one of Verse.ENGINES (see scan())
+        :param macronizations:  an iterable of Scansion objects (see macronize())
+        :return:                a tuple (options, patterns) of the set of scansions that match
+                                the meter and of a dictionary that maps every scansion to the meter
+                                pattern it matches
+        """
+        options = set()
+        patterns = {}  # the meter pattern every option was masked with
+        for macronization, pattern in self.__match(meter, precise, engine, macronizations):
+            scansion = macronization.apply_mask(pattern)
+            options.add(scansion)
+            patterns[scansion] = pattern
+            # TODO consider a very rare but theoretically possible case, when to scansions are
+            # the same, but words are macronized diffrently
+        return options, patterns
+
+    def __within_budget(self, macronizations, deadline):
+        """
+        Generate macronizations until the budget of this verse (scanner.max_candidates and
+        scanner.max_seconds) is exceeded, in which case self.budget_exceeded is set. The time is
+        checked whenever a macronization is matched (and by macronize() while generating them)
+        :param macronizations:  an iterable of Scansion objects
+        :param deadline:        see macronize()
+        :return:                a generator of Scansion objects
+        """
+        max_candidates = self.scanner.max_candidates
+        for i, macronization in enumerate(macronizations):
+            if (max_candidates and i >= max_candidates) or \
+                    (deadline is not None and time.perf_counter() > deadline):
+                self.budget_exceeded = True
+                return
+            yield macronization
+
+    def __beam_macronize(self, meter):
+        """
+        Generate the most likely macronizations of the line with a beam search. The words are
+        macronized from left to right and only scanner.beam_width partial macronizations that can be
+        the beginning of a verse in the meter are kept after each word. A macronization is ranked
+        by the number of times its words' scansions occur in MqDq (see Word.count_scansion())
+        :param meter:   the meter to use as a constraint
+        :return:        a list of Scansion objects (most likely first)
+        """
+        beam = [(0.0, Scansion(""))]
+        for word in self.words:
+            word_macronizations = [(math.log1p(word.count_scansion(macrons.scansion)), macrons)
+                                   for macrons in word.macronize()]
+            candidates = []
+            for score, prefix in beam:
+                for word_score, macrons in word_macronizations:
+                    new_prefix = prefix + macrons
+                    if meter.can_begin_with(new_prefix):
+                        candidates.append((score + word_score, new_prefix))
+            candidates.sort(key=lambda x: -x[0])  # stable, so that ties are broken consistently
+            beam = candidates[:self.scanner.beam_width]
+        return [macronization for _, macronization in beam]
+
+    def __match(self, meter, precise, engine, macronizations):
+        """
+        Generate all pairs of a macronization of this line and a meter pattern it matches
+        :param meter:           the meter to use as a constraint for the scansion
+        :param precise:         whether to allow anceps symbols in the final scansion
+        :param engine:          one of Verse.ENGINES (see scan())
+        :param macronizations:  an iterable of Scansion objects (see macronize())
+        :return:                a generator of tuples of Scansion objects
+        """
+        macronizations = iter(macronizations)  # batches are taken from it one after another
+        get_matching_scansions = meter.get_matching_scansions
+        get_matching_pairs = meter.get_matching_pairs
+        profiler = self.scanner.profiler
+        if profiler:
+            macronizations = profiler.iterate("macronize", macronizations, "macronizations")
+            get_matching_scansions = profiler.wrap("match", get_matching_scansions)
+            get_matching_pairs = profiler.wrap("match", get_matching_pairs)
+        if engine == "python":
+            for macronization in macronizations:
+                for pattern in get_matching_scansions(macronization, precise):
+                    yield macronization, pattern
+        elif engine == "numpy":
+            batch = list(islice(macronizations, Verse.BATCH_SIZE))
+            while batch:
+                yield from get_matching_pairs(batch, precise)
+                batch = list(islice(macronizations, Verse.BATCH_SIZE))
+        else:
+            raise ValueError("Unknown scansion engine: " + engine)
 
     def __resolve_automatically(self, options):
         """
-        Attempt to choose a scansion option based on word scansion frequency
+        Attempt to choose a scansion option based on word scansion frequency. The most likely
+        option is chosen if, when it is compared with any other option alone, the posterior
+        probability of the other option is scanner.cutoff or lower (see score_options())
         :param options:
         :return:
         """
-        options_copy = deepcopy(options)
-        best_option = options_copy.pop()
-        while options_copy:
-            new_option = options_copy.pop()
-            best_option, score = self.score_scansions(best_option, new_option)
-            if (1 - score) > Verse.CUTOFF:
+        self.posterior = self.score_options(options)
+        best_option = self.posterior[0][0]
+        for option, _ in self.posterior[1:]:
+            if (1 - dict(self.score_options((best_option, option)))[best_option]) > \
+                    self.scanner.cutoff:
                 return options
         self.flags.append("Resolved Automatically")
         return {best_option, }
 
+    @property
+    def confidence(self):
+        """
+        The posterior probability of the most likely scansion option or None if the line
+        could not be scanned automatically (see score_options())
+        :return: a float or None
+        """
+        if not self.posterior:
+            return None
+        return self.posterior[0][1]
+
+    @property
+    def margin(self):
+        """
+        The difference between the posterior probabilities of the two most likely scansion options
+        or None if the line could not be scanned automatically
+        :return: a float or None
+        """
+        if not self.posterior:
+            return None
+        if len(self.posterior) == 1:
+            return self.posterior[0][1]
+        return self.posterior[0][1] - self.posterior[1][1]
+
     def __resolve(self, options, interactive):
         """
         Prompt the user to choose a correct scansion among several options
         :param options:
         :return:
         """
-        resolved = self.__resolve_automatically(options)
+        with stage(self.scanner.profiler, "resolve"):
+            resolved = self.__resolve_automatically(options)
         if len(resolved) == 1:
             return resolved
         if not interactive:
             return options
         print("\nPlease choose a scansion option manually for verse:\n" + self.unaltered)
-        scansions = list(options)
+        scansions = [scansion for scansion, _ in self.posterior]
         for i, scansion in enumerate(scansions):
             print("\t" + str(i) + ") " + str(scansion))
         print("\t" + str(i + 1) + ") None of the above (scansion will be marked as failed)")
@@ -150,23 +331,28 @@ class Verse:
             answer = input()
         if int(answer) == i + 1:
             return options
-        Verse.DICT[self.verse_key] = {"scansion": scansions[int(answer)], "comment": ""}
+        self.scanner.manual[self.verse_key] = {"scansion": scansions[int(answer)], "comment": ""}
         return {scansions[int(answer)], }
 
-    def __get_manual_options(self, meter, precise):
+    def __get_manual_options(self, meter, precise, patterns):
         """
-        Look up the verse in Verse.DICT and return the scansions stored there
+        Look up the verse in scanner.manual and return the scansions stored there
         :param meter:       the meter to scan the verse with
         :param precise:     whether to allow anceps symbols in the final scansion
+        :param patterns:    a dictionary to which the meter pattern of every scansion is added
         :return:            a set of Scansion objects (can be empty)
         """
         manual_options = set()
-        if self.verse_key not in Verse.DICT:
+        if self.verse_key not in self.scanner.manual:
             return manual_options
-        line_scansion = Verse.DICT[self.verse_key]["scansion"]
+        line_scansion = self.scanner.manual[self.verse_key]["scansion"]
+        if isinstance(line_scansion, str):  # a verse added by __finish_scansion() to be scanned
+            line_scansion = Verse.parse_manual_scansion(line_scansion)
         meter_patterns = meter.get_matching_scansions(line_scansion, precise)
         for pattern in meter_patterns:
-            manual_options.add(line_scansion.apply_mask(pattern))
+            scansion = line_scansion.apply_mask(pattern)
+            manual_options.add(scansion)
+            patterns[scansion] = pattern
         if len(manual_options) != 1:
             warnings.warn("Scansion for line " + self.verse_key + " specified manually is "
                                                                   "not acceptable")
@@ -180,18 +366,19 @@ class Verse:
         :param auto_options:    the scansions created automatically (a dictionary)
         :param manual_options:  the scansions created manually (a set)
         :param add_failed:      If True, the lines that the program failed to scan will be added
-                                to Verse.DICT, so that they can later be scanned manually in the
-                                manual file
+                                to scanner.manual, so that they can later be scanned manually
+                                in the manual file
         :return:
         """
-        if self.verse_key not in Verse.DICT and len(manual_options) != 1:
+        manual = self.scanner.manual
+        if self.verse_key not in manual and len(manual_options) != 1:
             if len(auto_options) == 1:
                 self.scansion_method = "automatic"
                 scansion = auto_options.pop()
                 self.update_flags(scansion)
                 return scansion
             if add_failed:
-                Verse.DICT[self.verse_key] = {"scansion": self.unaltered, "comment": "toBeScanned"}
+                manual[self.verse_key] = {"scansion": self.unaltered, "comment": "toBeScanned"}
             if len(auto_options) == 0:
                 self.scansion_method = "failed"
             else:
@@ -199,8 +386,7 @@ class Verse:
             return None
         if len(manual_options) != 1:
             self.scansion_method = "failed"
-            Verse.DICT[self.verse_key] = {"scansion": self.unaltered,
-                                          "comment": "toBeScanned"}
+            manual[self.verse_key] = {"scansion": self.unaltered, "comment": "toBeScanned"}
             return None
         scansion = manual_options.pop()
         if len(auto_options) == 0:
@@ -219,6 +405,15 @@ class Verse:
                 self.scansion_method = "manual (corrected)"
         return scansion
 
+    @staticmethod
+    def parse_manual_scansion(line):
+        """
+        Convert a verse scanned manually (as it appears in the manual file) to a Scansion
+        :param line:    the verse with the quantities marked
+        :return:        Scansion
+        """
+        return Scansion(collapse_spaces(Verse.NOT_SCANSION.sub(" ", line.lower())))
+
     @staticmethod
     def get_verse_key(verse):
         """
@@ -227,40 +422,4 @@ class Verse:
         :param verse:   the verse as it appears in text
         :return:        a string
         """
-        key = re.sub(r"( *[^a-zA-Z] *|[ ]+)", "", verse).lower()
-        return multireplace(key, {"j": "i", "v": "u"})
-
-    @staticmethod
-    def read_manual_file(filename):
-        """
-        Populate Verse.DICT with manually made scansions
-        :param filename:    the name of the file from which to extract the manual scansions
-        :return:            None
-        """
-        if not filename:
-            return
-        print("Loading manual scansions...")
-        with open(filename, "r") as file:
-            lines = file.readlines()
-        lines = [line.rstrip("\n").split("\t") for line in lines]
-        for line in lines:
-            verse_key = Verse.get_verse_key(line[0])
-            scansion = re.sub(r"([^a-z_\^*\[\]()])", " ", line[0].lower()).rstrip(" ").lstrip(" ")
-            scansion = Scansion(re.sub(" +", " ", scansion))
-            if len(line) == 1:
-                Verse.DICT[verse_key] = {"scansion": scansion, "comment": ""}
-            else:
-                Verse.DICT[verse_key] = {"scansion": scansion, "comment": line[1]}
-
-    @staticmethod
-    def save_manual_file(filename):
-        """
-        Save Verse.DICT to file
-        :param filename:    the name of the file to which to write the data
-        :return:            None
-        """
-        if not filename:
-            return
-        with open(filename, "w") as file:
-            for value in Verse.DICT.values():
-                file.write(str(value["scansion"]) + "\t" + value["comment"] + "\n")
+        return verse_key(verse)
@@ -1,9 +1,12 @@
 from src.utils import *
+from src.normalize import FOLD_UJ, fold_vj, remove_diphthongs
+import os
+import pickle
+import sys
 import warnings
-# import joblib
-from tqdm import tqdm
 from src.scan.scansion import Scansion
 from src.mqdq.dictionary import MqDqDictionary
+from src.mqdq.indexed_dictionary import IndexedMqDqDictionary
 from collections import defaultdict
 
 
@@ -11,33 +14,35 @@ class Word:
     """ Represents a single word in a text """
 
     USE_DICTIONARY = True  # set False for debug purposes only
-    # see scan.py command line arguments description for the following variables:
-    DIPHTHONG = True
-    TOTAL_COUNT = 10
-    AUTHOR_COUNT = 3
+    MORPHEUS_SNAPSHOT_VERSION = 1  # increment whenever the format of the snapshot changes
 
-    MORPHEUS_DICT = defaultdict(set)
-    MQDQ_DICT = MqDqDictionary()
-
-    def __init__(self, word, next_word):
+    def __init__(self, word, next_word, scanner):
         """
         Initialize a new word object from a string
         :param word:        a word, which may comprise of lowercase alphabetical characters only
         :param next_word:   next word in the line, which is used to detect elisions
+        :param scanner:     the Scanner that provides the dictionaries, the settings and the caches
         """
+        self.scanner = scanner
         if next_word:
             self.next_word_prefix = next_word.__get_prefix()
         else:
             self.next_word_prefix = None
 
+        cached = scanner.cache.get(word, self.next_word_prefix)
+        if cached is not None:
+            self.word, self.postfix, self.next_word_prefix, self.is_new, scansions = cached
+            self.scansions = {WordScansion(*x) for x in scansions}
+            return
+        form, prefix = word, self.next_word_prefix
+
         # checking if the word has a postfix like que
         self.word = word  # word - postfix like que, if there is one
         self.scansions = self.__look_up()
         self.__check_if_has_postfix(self.next_word_prefix)
         if self.postfix != "":
             self.scansions = self.__look_up()
-            self.next_word_prefix = multireplace(Word.PREFIX.match(self.postfix).group(),
-                                            {"u": "v", "j": "i"})
+            self.next_word_prefix = Word.PREFIX.match(self.postfix).group().translate(FOLD_UJ)
 
         # workaround for cases when a word is completely unknown
         self.is_new = len(self.scansions) == 0
@@ -46,6 +51,9 @@ class Word:
 
         for scansion in self.scansions:
             self.__process(scansion, self.next_word_prefix)
+        scanner.cache.put(form, prefix, (self.word, self.postfix, self.next_word_prefix,
+                                         self.is_new,
+                                         [[x.scansion, x.isMqDq] for x in self.scansions]))
 
     def __process(self, word_scansion, next_word_prefix):
         scansion = word_scansion.scansion
@@ -110,7 +118,7 @@ class Word:
             else:
                 warnings.warn("More than one possible prefix for word with the "
                               "following scansions: {}".format(self))
-        return prefixes.pop()
+        return min(prefixes)  # the same prefix is chosen on every run
 
     def is_mqdq_only(self, scansion):
         if self.is_new:
@@ -123,90 +131,245 @@ class Word:
     def is_morpheus_only(self, scansion):
         pass
 
-    def compare_scansions(self, scansion1, scansion2):
+    def count_scansion(self, scansion):
         """
-        Compare two ways of scanning a word by calculating how many mqdq entries match the given
-        scansions
-        :param scansion1:
-        :param scansion2:
-        :return:
+        Count how many times MqDq entries matching the given way of scanning this word occur in
+        the MqDq dictionary
+        :param scansion:    a string (the scansion of this word as it appears in a line)
+        :return:            an integer
+        """
+        scansion = self.__strip_postfix(scansion)
+        return sum(count for mqdq_scansion, count in self.__mqdq_table()
+                   if mqdq_scansion.matches(scansion))
+
+    def count_distinct_scansions(self, scansions):
+        """
+        For each of several ways of scanning this word, count how many times MqDq entries that
+        match it but none of the others occur in the MqDq dictionary. Entries that match several
+        of the scansions (e.g. because of an anceps) do not tell them apart and are not counted
+        :param scansions:   a list of distinct strings (the scansions of this word as it appears
+                            in a line)
+        :return:            a list of integers, one per scansion
+        """
+        scansions = [self.__strip_postfix(x) for x in scansions]
+        counts = [0] * len(scansions)
+        for mqdq_scansion, count in self.__mqdq_table():
+            matches = [i for i, x in enumerate(scansions) if mqdq_scansion.matches(x)]
+            if len(matches) == 1:
+                counts[matches[0]] += count
+        return counts
+
+    def __strip_postfix(self, scansion):
+        """
+        Remove the final syllable of a postfix like que from the scansion of this word, so that it
+        can be compared with the MqDq entries
+        :param scansion:    a string (the scansion of this word as it appears in a line)
+        :return:            Scansion
         """
         if (len(self.postfix) != 0) and ("(" not in self.postfix):
-            scansion1 = Scansion(scansion1).pattern[:-1]
-            scansion2 = Scansion(scansion2).pattern[:-1]
-        key = multireplace(self.word, {"v": "u", "j": "i"})
-        mqdq_entries = Word.MQDQ_DICT.look_up(key)
-        s1_count, s2_count = 0, 0
+            scansion = Scansion(scansion).pattern[:-1]
+        return Scansion(scansion)
+
+    def __mqdq_table(self):
+        """
+        Return the MqDq scansions of this word processed in the context of the following word
+        together with the total number of times each of them occurs in MqDq. Scansions with the
+        same quantities are merged. The table only depends on the word and the prefix of the
+        following word, so it is computed once per such pair and stored in scanner.mqdq_tables
+        :return: a tuple of tuples (Scansion, integer)
+        """
+        key = fold_vj(self.word)
+        table = self.scanner.mqdq_tables.get(key, self.next_word_prefix)
+        if table is not None:
+            return table
+        counts = {}
+        mqdq_entries = self.scanner.mqdq_dict.look_up(key)
         for entry in mqdq_entries.keys():
             mqdq_scansion = WordScansion(entry, True)
             self.__process(mqdq_scansion, self.next_word_prefix)
-            matches1 = Scansion(mqdq_scansion.scansion).matches(Scansion(scansion1))
-            matches2 = Scansion(mqdq_scansion.scansion).matches(Scansion(scansion2))
-            if matches1 and not matches2:
-                s1_count += sum(mqdq_entries[entry].values())
-            elif not matches1 and matches2:
-                s2_count += sum(mqdq_entries[entry].values())
-        if s1_count + s2_count == 0:
-            return 0.5, 0.5
-        if s1_count == 0:
-            s1_count = 1
-            s2_count += 1
-        elif s2_count == 0:
-            s2_count = 1
-            s1_count += 1
-        return s1_count / (s1_count + s2_count), s2_count / (s1_count + s2_count)
+            mqdq_scansion = Scansion(mqdq_scansion.scansion)
+            counts[mqdq_scansion] = counts.get(mqdq_scansion, 0) + \
+                sum(mqdq_entries[entry].values())
+        table = tuple(counts.items())
+        self.scanner.mqdq_tables.put(key, self.next_word_prefix, table)
+        return table
 
     def macronize(self):
-        return [Scansion(x.scansion + self.postfix) for x in self.scansions]
+        """
+        Return the possible macronizations of the word. They are sorted, so that the
+        macronizations of a verse are generated in the same order on every run (which of the
+        macronizations with equal quantities ends up in the scansion depends on that order)
+        :return: a list of Scansion objects
+        """
+        return [Scansion(x.scansion + self.postfix)
+                for x in sorted(self.scansions, key=lambda x: (x.scansion, x.isMqDq))]
 
     def __look_up(self):
         """
         Look up self.word in the dictionaries. Return a set of WordScansion objects
         :return:
         """
-        key = multireplace(self.word, {"v": "u", "j": "i"})
-        scansions = {WordScansion(x, False) for x in Word.MORPHEUS_DICT[key]}
+        key = fold_vj(self.word)
+        scansions = {WordScansion(x, False) for x in self.scanner.morpheus_dict.get(key, ())}
         hasMorpheusEntries = len(scansions) != 0
-        mqdq_entry = Word.MQDQ_DICT.look_up(key)
+        mqdq_entry = self.scanner.mqdq_dict.look_up(key)
         for scansion in mqdq_entry.keys():
             if sum([Scansion(scansion).matches(Scansion(x.scansion)) for x in scansions]) != 0:
                 continue  # do not consider scansion options that already exist
                 # TODO check how well this works
-            if hasMorpheusEntries and (len(mqdq_entry[scansion].keys()) < Word.AUTHOR_COUNT or sum(
-                    mqdq_entry[scansion].values()) < Word.TOTAL_COUNT or "*" in scansion):
+            if hasMorpheusEntries and (
+                    len(mqdq_entry[scansion].keys()) < self.scanner.author_count or
+                    sum(mqdq_entry[scansion].values()) < self.scanner.total_count or
+                    "*" in scansion):
                 continue  # do not consider infrequent scansions
                 # TODO should (or "*" in scansion) be added here
             if not hasMorpheusEntries:
                 # make final syllable unknown
-                scansion = re.sub("[\^_]([^\^_*[\]()]*)$", r"*\1", scansion)
+                scansion = Word.FINAL_QUANTITY.sub(r"*\1", scansion)
             scansions.add(WordScansion(scansion, True))
         return scansions
 
     @staticmethod
     def load_mqdq_dict(filename):
+        """
+        Load an MqDq dictionary
+        :param filename:    the dictionary file (or None)
+        :return:            an MqDqDictionary (empty if filename is None)
+        """
         if not filename:
-            return
+            return MqDqDictionary()
         print("Loading MqDq dictionary...")
+        if filename.endswith(IndexedMqDqDictionary.EXTENSION):
+            return IndexedMqDqDictionary(filename)
+        dictionary = MqDqDictionary()
         with open(filename, "r") as file:
-            Word.MQDQ_DICT.load(file)
+            dictionary.load(file)
+        return dictionary
 
     @staticmethod
-    def load_morpheus_dict(filename):
+    def load_morpheus_dict(filename, diphthongs=True, use_snapshot=True):
+        """
+        Load the Morpheus dictionary. Parsing the dictionary is slow, so the parsed dictionary is
+        saved to a snapshot file (filename + ".snapshot"), which is loaded instead on subsequent
+        runs. A snapshot is ignored and rebuilt if the dictionary file, the diphthongs setting, or
+        the code that parses the dictionary have changed since the snapshot was made.
+        :param filename:        the Morpheus dictionary file
+        :param diphthongs:      see the --no_diphthongs argument of scan.py
+        :param use_snapshot:    if False, always parse the dictionary and do not write a snapshot
+        :return:                a dictionary that maps a word to the set of its scansions
+        """
+        snapshot = filename + ".snapshot"
+        if use_snapshot:
+            morpheus_dict = Word.__load_morpheus_snapshot(snapshot, filename, diphthongs)
+            if morpheus_dict is not None:
+                return morpheus_dict
         print("Loading Morpheus dictionary...")
         with open(filename, "r") as file:
             lines = file.readlines()
-        for line in tqdm(lines):
-            key, _, _, scansion = line.rstrip("\n").split("\t")
-            key = multireplace(key.lower(), {"v": "u", "j": "i"})
-            scansion = re.sub("(_\^|\^_)", r"*", scansion)
-            scansion = Word.__u_to_v(scansion)
-            scansion = Word.DIPHTH_REGEX.sub(r"[\1]", scansion)  # marking all diphthongs
-            scansion = Word.VOWELS_REGEX.sub(r"\1*", scansion)  # marking all vowels
-            if not DIPHTHONGS:
-                scansion = re.sub("(\[ae\]|\[oe\])", "e_", scansion)
-            Word.MORPHEUS_DICT[key].add(scansion.lower())
-        # joblib.dump(Word.MORPHEUS_DICT, "../../data/morpheusdict")
-        # Word.MORPHEUS_DICT = joblib.load("../../data/morpheusdict")
+        morpheus_dict = defaultdict(set)
+        for line in progress(lines):
+            key, scansion = Word.__parse_morpheus_line(line, diphthongs)
+            morpheus_dict[key].add(scansion)
+        morpheus_dict = dict(morpheus_dict)
+        if use_snapshot:
+            Word.compile_morpheus_dict(filename, snapshot, morpheus_dict, diphthongs)
+        return morpheus_dict
+
+    @staticmethod
+    def compile_morpheus_dict(filename, snapshot, morpheus_dict, diphthongs):
+        """
+        Save a parsed Morpheus dictionary to a snapshot file. The snapshot starts with a header
+        that describes how it was made (see __morpheus_signature()), followed by the dictionary
+        itself
+        :param filename:        the Morpheus dictionary file the dictionary was loaded from
+        :param snapshot:        the snapshot file to write
+        :param morpheus_dict:   the dictionary (see load_morpheus_dict())
+        :param diphthongs:      the diphthongs setting the dictionary was parsed with
+        :return:                None
+        """
+        tmp_snapshot = "{}.{}.tmp".format(snapshot, os.getpid())
+        with open(tmp_snapshot, "wb") as file:
+            pickle.dump(Word.__morpheus_signature(filename, diphthongs), file,
+                        pickle.HIGHEST_PROTOCOL)
+            pickle.dump(morpheus_dict, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_snapshot, snapshot)  # so that concurrent readers never see a partial file
+
+    @staticmethod
+    def __load_morpheus_snapshot(snapshot, filename, diphthongs):
+        """
+        Load the Morpheus dictionary from a snapshot, if the snapshot is up to date
+        :param snapshot:    the snapshot file
+        :param filename:    the Morpheus dictionary file the snapshot was made from
+        :param diphthongs:  the diphthongs setting the dictionary should be parsed with
+        :return:            the dictionary or None if the snapshot is missing or out of date
+        """
+        if not os.path.exists(snapshot):
+            return None
+        with open(snapshot, "rb") as file:
+            try:
+                if pickle.load(file) != Word.__morpheus_signature(filename, diphthongs):
+                    return None
+                print("Loading Morpheus dictionary snapshot...")
+                return pickle.load(file)
+            except (pickle.UnpicklingError, EOFError):
+                return None
+
+    @staticmethod
+    def code_signature():
+        """
+        Hash the source code that words are analysed with (this module, the scansion module and
+        the consonant and vowel definitions), so that analyses saved by an older version of the
+        code (see WordCache) are not reused
+        :return:    a string
+        """
+        import hashlib  # imported on first use, so that importing this module stays fast
+        import inspect
+        code = hashlib.sha1()
+        for module in (sys.modules[Word.__module__], sys.modules[Scansion.__module__],
+                       sys.modules[multireplace.__module__]):
+            code.update(inspect.getsource(module).encode("utf-8"))
+        return code.hexdigest()
+
+    @staticmethod
+    def __morpheus_signature(filename, diphthongs):
+        """
+        Describe everything that the parsed Morpheus dictionary depends on: the dictionary file,
+        the settings, and the source code and regular expressions used for parsing
+        :param filename:    the Morpheus dictionary file
+        :param diphthongs:  the diphthongs setting
+        :return:            a dictionary
+        """
+        stat = os.stat(filename)
+        import hashlib  # imported on first use, so that importing this module stays fast
+        import inspect
+        code = hashlib.sha1()
+        for function in (Word.__parse_morpheus_line, Word.__u_to_v):
+            code.update(inspect.getsource(function).encode("utf-8"))
+        for regex in (Word.DIPHTH_REGEX, Word.VOWELS_REGEX, Word.AMBIGUOUS_QUANTITY,
+                      Word.QU_GU_REGEX, Word.FINAL_UE_REGEX, Word.CONSONANT_U_REGEX):
+            code.update(regex.pattern.encode("utf-8"))
+        return {"version": Word.MORPHEUS_SNAPSHOT_VERSION,
+                "file": [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns],
+                "diphthongs": diphthongs,
+                "code": code.hexdigest()}
+
+    @staticmethod
+    def __parse_morpheus_line(line, diphthongs):
+        """
+        Parse a line of the Morpheus dictionary
+        :param line:        a line of the dictionary (key, two unused fields and the scansion)
+        :param diphthongs:  if False, diphthongs are not marked (see --no_diphthongs of scan.py)
+        :return:            a tuple (key, scansion)
+        """
+        key, _, _, scansion = line.rstrip("\n").split("\t")
+        key = fold_vj(key.lower())
+        scansion = Word.AMBIGUOUS_QUANTITY.sub("*", scansion)
+        scansion = Word.__u_to_v(scansion)
+        scansion = Word.DIPHTH_REGEX.sub(r"[\1]", scansion)  # marking all diphthongs
+        scansion = Word.VOWELS_REGEX.sub(r"\1*", scansion)  # marking all vowels
+        if not diphthongs:
+            scansion = remove_diphthongs(scansion)
+        return key, scansion.lower()
 
     def __str__(self):
         result = ""
@@ -235,10 +398,10 @@ class Word:
         # then "u" follows "s", "g", or "q" - it is a consonant (technically, a
         # semivowel, but this is irrelevant for current purposes)
         # SOURCE: Allen and Greenough
-        scansion = re.sub(r'([qg])u([' + VOWELS + '])', r'\1v\2', scansion)
-        scansion = re.sub(r'ue$', r've', scansion)
+        scansion = Word.QU_GU_REGEX.sub(r'\1v\2', scansion)
+        scansion = Word.FINAL_UE_REGEX.sub(r've', scansion)
         # u in the beginning of the word followed by a vowel is a consonant.
-        return re.sub(r'(^|[' + VOWELS + '])u([' + VOWELS + '])', r'\1v\2', scansion)
+        return Word.CONSONANT_U_REGEX.sub(r'\1v\2', scansion)
 
 Word.LONG_BY_POS = re.compile(r"[\^*](" + CLOSE_SYLLABLE + "|[" + CONSONANTS_NOT_H + "]{3})")
 
@@ -248,6 +411,15 @@ Word.DIPHTH_REGEX = re.compile("(" + "|".join(DIPHTHONGS) + r")(?![\]\^_*])")
 # diphthongs, which can alternatively be seen as a long vowel + a consonantal j or v
 Word.VOWELS_REGEX = re.compile("(?<!\[)([" + VOWELS + r"])(?![\]\^_*])")
 
+# consonantal u (see __u_to_v()):
+Word.QU_GU_REGEX = re.compile(r'([qg])u([' + VOWELS + '])')
+Word.FINAL_UE_REGEX = re.compile(r'ue$')
+Word.CONSONANT_U_REGEX = re.compile(r'(^|[' + VOWELS + '])u([' + VOWELS + '])')
+
+# quantities
+Word.AMBIGUOUS_QUANTITY = re.compile("(_\^|\^_)")  # Morpheus marks anceps as both long and short
+Word.FINAL_QUANTITY = re.compile("[\^_]([^\^_*[\]()]*)$")  # quantity of the final vowel
+
 # elision
 Word.ELIDE_VOWEL = re.compile("([" + VOWELS + "])[\^_*](m |m h| h| )$")
 Word.ELIDE_DIPHTHONG = re.compile("\[(" + "|".join(DIPHTHONGS) + ")\](m | m h| h| )$")
@@ -0,0 +1,99 @@
+import json
+from collections import OrderedDict
+
+
+class WordCache:
+    """
+    A bounded cache of word analyses with least-recently-used eviction. The way a word is
+    scanned only depends on its form and on the prefix of the following word (which determines
+    elision and length by position), so Word objects built from the same form and prefix can share
+    the same analysis. The cache can optionally be saved to and loaded from a file, so that
+    repeated runs over the same corpus start warm.
+    """
+
+    def __init__(self, max_size=50000):
+        """
+        Initialize an empty cache
+        :param max_size:    maximum number of entries to keep. If 0, nothing is cached
+        """
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, form, next_word_prefix):
+        """
+        Look up the analysis of a word
+        :param form:                the word as passed to Word's initializer
+        :param next_word_prefix:    the prefix of the following word or None
+        :return:                    the cached entry or None
+        """
+        key = (form, next_word_prefix)
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return entry
+
+    def put(self, form, next_word_prefix, entry):
+        """
+        Store the analysis of a word, evicting the least recently used entry if the cache is full
+        :param form:                the word as passed to Word's initializer
+        :param next_word_prefix:    the prefix of the following word or None
+        :param entry:               a tuple (of JSON-serializable values, if the cache is to
+                                    be saved)
+        :return:                    None
+        """
+        if self.max_size <= 0:
+            return
+        key = (form, next_word_prefix)
+        self.data[key] = entry
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries (e.g. after the dictionaries or the settings of Word have changed)
+        :return: None
+        """
+        self.data.clear()
+
+    def load(self, filename, signature):
+        """
+        Populate the cache from a file written by save(). The file is ignored if it does not
+        exist or was created with a different signature
+        :param filename:    the name of the file to read
+        :param signature:   a JSON-serializable value describing the dictionaries and the
+                            settings with which the cached analyses were made
+        :return:            None
+        """
+        try:
+            with open(filename, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        if data["signature"] != json.loads(json.dumps(signature)):
+            return
+        for form, next_word_prefix, entry in data["entries"]:
+            self.put(form, next_word_prefix, tuple(entry))
+
+    def save(self, filename, signature):
+        """
+        Save the cache to a file
+        :param filename:    the name of the file to write
+        :param signature:   see load()
+        :return:            None
+        """
+        entries = [[form, next_word_prefix, entry]
+                   for (form, next_word_prefix), entry in self.data.items()]
+        with open(filename, "w") as file:
+            json.dump({"signature": signature, "entries": entries}, file)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return "{} entries, {} hits, {} misses".format(len(self), self.hits, self.misses)
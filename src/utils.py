@@ -42,4 +42,29 @@ def multireplace(string, replacements):
     regexp = re.compile("|".join(map(re.escape, substrs)))
 
     # For each match, look up the new string in the replacements
-    return regexp.sub(lambda match: replacements[match.group(0)], string)
\ No newline at end of file
+    return regexp.sub(lambda match: replacements[match.group(0)], string)
+
+
+def progress(iterable, **kwargs):
+    """
+    Wrap an iterable in a tqdm progress bar. tqdm is only imported when a progress bar is shown,
+    since importing it takes longer than importing the rest of the library
+    :param iterable:    the iterable to wrap
+    :param kwargs:      other arguments to pass to tqdm
+    :return:            tqdm
+    """
+    from tqdm import tqdm
+    return tqdm(iterable, **kwargs)
+
+
+def positive_int(value):
+    """
+    Parse a command line argument that must be a positive integer (e.g. -jobs)
+    :param value:   the string passed on the command line
+    :return:        int
+    """
+    import argparse
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got " + value)
+    return number